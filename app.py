@@ -1,28 +1,98 @@
+import base64
 import json
 import os
+import uuid
 
 import dash_bootstrap_components as dbc
 import dash_cytoscape as cyto
 import dotenv
-from dash import Dash, Input, Output, Patch, State, dcc, html, ctx
-
-from db import database
-from debug import tabs, built_layouts, layout_filters
-from queries import get_actor_info_basic, get_actor_relations, get_random_actor
-from style import default_stylesheet
+from dash import ALL, Dash, Input, Output, Patch, State, dcc, html, ctx, no_update
+from flask import jsonify, request
+
+from cache import MOVIES_CACHE_PATH, SharedCache, cached, cached_batch
+from clustering import (
+    LOD_MAX_ELEMENTS,
+    get_communities,
+    is_community,
+    level_of_detail,
+    level_of_detail_patch,
+    member_ids,
+)
+from db import GRAPH_BACKEND, LOCAL_GRAPH_PATH, database
+from sampler import SAMPLER_PATH, ActorSampler
+from sessions import UNCHANGED, SessionStore
+from snapshot import SNAPSHOT_MAX_BYTES, SnapshotStore, dump_snapshot, load_snapshot
+from debug import DEBUG_PAGE_SIZE, tabs, built_layouts, layout_filters
+from layout import layout_graph, layout_options
+from local_graph import LocalGraph, get_shortest_path
+from formatting import movie_sort_key, movie_string
+from style import default_stylesheet, filter_stylesheet
+from typeahead import TYPEAHEAD_PATH, TypeaheadIndex
 from utils import (
-    get_degrees,
-    get_edges,
-    get_nodes,
+    GraphState,
+    get_aggregate_edge_info,
+    get_community_info,
     get_single_edge_info,
     get_single_node_info,
 )
 
+if GRAPH_BACKEND == "local":
+    from local_graph import (
+        get_actor_info_basic,
+        get_actor_info_by_id,
+        get_actor_relations,
+        get_actors_relations_by_id,
+        get_movies_by_id,
+        get_random_actor,
+    )
+else:
+    from queries import (
+        get_actor_info_basic,
+        get_actor_info_by_id,
+        get_actor_relations,
+        get_actors_relations_by_id,
+        get_movies_by_id,
+        get_random_actor,
+    )
+
 dotenv.load_dotenv(override=True)
 
 dash_debug_str = os.getenv("DASH_DEBUG")
 DASH_DEBUG = True if dash_debug_str == "true" else False
 
+# "aggregate" (default) or "edges" once build_edges.py has been run
+RELATIONS_MODE = os.getenv("RELATIONS_MODE", "aggregate")
+# alerts shown at once, at most, see alert_patch
+MAX_ALERTS = 8
+
+relations_cache = SharedCache()
+# bump the version of a namespace when the shape of its results changes,
+# entries cached by an older version are then never read again
+get_actor_relations = cached(relations_cache, "relations:v2")(get_actor_relations)
+get_actor_info_basic = cached(relations_cache, "info")(get_actor_info_basic)
+get_actors_relations_by_id = cached_batch(relations_cache, "relations_by_id:v2")(
+    get_actors_relations_by_id
+)
+get_actor_info_by_id = cached(relations_cache, "info_by_id")(get_actor_info_by_id)
+# movie details are only fetched for the selected edges, see displayEdgeData
+movies_cache = SharedCache(MOVIES_CACHE_PATH)
+get_movies_by_id = cached_batch(movies_cache, "movies")(get_movies_by_id)
+
+# precomputed by sampler.py, fall back on a $sample over all actors if missing
+actor_sampler = ActorSampler.load() if os.path.exists(SAMPLER_PATH) else None
+# precomputed by typeahead.py, no suggestions if missing
+typeahead_index = TypeaheadIndex.load() if os.path.exists(TYPEAHEAD_PATH) else None
+
+# shortest paths run on the local graph built by local_graph.py, disabled if missing
+if GRAPH_BACKEND == "local":
+    path_graph = database
+else:
+    path_graph = LocalGraph(LOCAL_GRAPH_PATH) if os.path.exists(LOCAL_GRAPH_PATH) else None
+
+# authoritative graph of each browser session, the client only receives differences
+session_store = SessionStore()
+snapshot_store = SnapshotStore()
+
 cyto.load_extra_layouts()
 
 
@@ -33,8 +103,22 @@ app = Dash(
 app.title = "Co-stardom network"
 server = app.server
 
+
+@server.route("/cache-stats")
+def cache_stats():
+    return {"relations": relations_cache.stats(), "movies": movies_cache.stats()}
+
+
+@server.route("/suggest")
+def suggest():
+    query = request.args.get("q", "")
+    k = request.args.get("k", 10, type=int)
+    return jsonify(typeahead_index.suggest(query, k) if typeahead_index is not None else [])
+
+
 cyto_graph = cyto.Cytoscape(
     id="cyto_graph",
+    elements=[],
     layout={
         "name": "fcose",
         "animate": True,
@@ -67,7 +151,13 @@ add_remove_actor_panel = dbc.Card(
                 dbc.Label("Add actors to the graph", html_for="actor_add"),
                 dbc.InputGroup(
                     [
-                        dbc.Input(id="actor_add", type="text", value="Will Smith"),
+                        dbc.Input(
+                            id="actor_add",
+                            type="text",
+                            value="Will Smith",
+                            list="actor_add_suggestions",
+                        ),
+                        html.Datalist(id="actor_add_suggestions"),
                         dbc.Button(id="actor_add_button", children="Add", color="success"),
                     ]
                 ),
@@ -78,7 +168,13 @@ add_remove_actor_panel = dbc.Card(
                 dbc.Label("Remove actors from the graph", html_for="actor_rm"),
                 dbc.InputGroup(
                     [
-                        dbc.Input(id="actor_rm", type="text", placeholder="Will Smith"),
+                        dbc.Input(
+                            id="actor_rm",
+                            type="text",
+                            placeholder="Will Smith",
+                            list="actor_rm_suggestions",
+                        ),
+                        html.Datalist(id="actor_rm_suggestions"),
                         dbc.Button(id="actor_rm_button", children="Remove", color="danger"),
                     ]
                 ),
@@ -90,6 +186,66 @@ add_remove_actor_panel = dbc.Card(
 )
 
 
+path_panel = dbc.Card(
+    [
+        html.Div(
+            [
+                dbc.Label("Shortest path between two actors", html_for="path_from"),
+                dbc.Input(
+                    id="path_from",
+                    type="text",
+                    placeholder="Will Smith",
+                    list="path_from_suggestions",
+                ),
+                html.Datalist(id="path_from_suggestions"),
+                dbc.InputGroup(
+                    [
+                        dbc.Input(
+                            id="path_to",
+                            type="text",
+                            placeholder="Kevin Bacon",
+                            list="path_to_suggestions",
+                        ),
+                        html.Datalist(id="path_to_suggestions"),
+                        dbc.Button(id="path_button", children="Connect", color="primary"),
+                    ]
+                ),
+                html.Div(id="path_info", children=""),
+            ]
+        ),
+    ],
+    body=True,
+    className="my-2",
+)
+
+snapshot_panel = dbc.Card(
+    [
+        html.Div(
+            [
+                dbc.Label("Save or open a graph snapshot", html_for="snapshot_id"),
+                dbc.InputGroup(
+                    [
+                        dbc.Input(id="snapshot_id", type="text", placeholder="Snapshot id"),
+                        dbc.Button(id="snapshot_open_button", children="Open", color="primary"),
+                        dbc.Button(id="snapshot_save_button", children="Save", color="secondary"),
+                    ]
+                ),
+                dcc.Upload(
+                    id="snapshot_upload",
+                    children=html.Div(["Drop or ", html.A("select"), " a snapshot file"]),
+                    max_size=SNAPSHOT_MAX_BYTES,
+                    className="border rounded text-center text-muted small p-2 mt-2",
+                    style={"borderStyle": "dashed", "cursor": "pointer"},
+                ),
+                dcc.Download(id="snapshot_download"),
+            ]
+        ),
+    ],
+    body=True,
+    className="my-2",
+)
+
+
 def modebar_button(btn_id, fa_icon, btn_color, popover, btn_className=""):
     button = dbc.Button(
         children=html.I(className=f"fa-solid fa-{fa_icon} px-1", style={"color": "white"}),
@@ -114,7 +270,13 @@ filter_panel = dbc.Card(
                 dbc.Label("Filter actors on the graph", html_for="actor_filter"),
                 dbc.InputGroup(
                     [
-                        dbc.Input(id="actor_filter", type="text", placeholder="Angelina Jolie"),
+                        dbc.Input(
+                            id="actor_filter",
+                            type="text",
+                            placeholder="Angelina Jolie",
+                            list="actor_filter_suggestions",
+                        ),
+                        html.Datalist(id="actor_filter_suggestions"),
                         dbc.InputGroupText(html.I(className="fa-solid fa-filter")),
                     ]
                 ),
@@ -174,6 +336,16 @@ info_modal = html.Div(
                                             ".",
                                         ]
                                     ),
+                                    html.H3("Connecting actors"),
+                                    html.P(
+                                        [
+                                            "Type two actors in the shortest path inputs and click ",
+                                            dbc.Button(
+                                                "Connect", color="primary", className="btn-sm"
+                                            ),
+                                            " to add the shortest chain of co-stars between them.",
+                                        ]
+                                    ),
                                     html.H3("Selecting actors/relationships"),
                                     dcc.Markdown(
                                         """You can click and drag nodes and edges anywhere. 
@@ -183,6 +355,15 @@ as well as basic personal information on the actor/actress.
 Selecting an edge reveals the common movies these two actors have in the bottom right panel. 
 You can select simultaneously multiple nodes and edges with `Ctrl/Cmd+click` or with a click and drag rectangle box selection while holding `Ctrl/Cmd`."""
                                     ),
+                                    html.P(
+                                        [
+                                            "Very large networks are shown as communities of actors. Click a community to show its actors, hit ",
+                                            modebar_button(
+                                                "", "compress", "secondary", "", "btn-sm"
+                                            )[0],
+                                            " to fold them back.",
+                                        ]
+                                    ),
                                     html.H3("Removing actors"),
                                     html.P(
                                         [
@@ -266,6 +447,9 @@ modebar = html.Div(
                     "btn-expand-seleted-nodes", "user-plus", "success", "Expand selected nodes"
                 ),
                 *modebar_button("btn-rm-lonely-nodes", "broom", "info", "Remove lonely nodes"),
+                *modebar_button(
+                    "btn-collapse-communities", "compress", "secondary", "Collapse communities"
+                ),
                 *modebar_button(
                     "btn-rm-selected-nodes", "trash-can", "warning", "Remove selected nodes"
                 ),
@@ -287,63 +471,139 @@ def myAlert(message, color):
     return dbc.Alert(message, is_open=True, color=color, fade=True, duration=duration)
 
 
-alerts = []
-
-
-app.layout = dbc.Container(
-    [
-        dbc.Row(
-            [
-                html.Div(
-                    alerts,
-                    style={"width": "clamp(200px,33vw,500px)", "z-index": "1200"},
-                    className="position-fixed top-0 end-0 m-1",
-                    id="alert-container",
-                ),
-                dbc.Col(
+# alert-container is a ring buffer of MAX_ALERTS slots, new alerts overwrite the oldest ones,
+# which are long dismissed or expired by then
+alerts = [html.Div() for _ in range(MAX_ALERTS)]
+
+
+def alert_patch(session_id, new_alerts):
+    """Patch writing new_alerts into the alert ring buffer, the per-session alert count
+    tells which slots to use. Only the new alerts are sent, however long the session."""
+    new_alerts = new_alerts[-MAX_ALERTS:]
+    if not new_alerts:
+        return no_update
+    first, _ = session_store.update(session_id, "alerts", lambda count: count + len(new_alerts), 0)
+    patch = Patch()
+    for number, alert in enumerate(new_alerts, first):
+        # shown in chronological order whatever their slot
+        alert.style = {"order": number}
+        patch[number % MAX_ALERTS] = alert
+    return patch
+
+
+def serve_layout():
+    # a new session id for every page load, as the graph used to be reset on reload
+    return dbc.Container(
+        [
+            dcc.Store(id="session_id", data=str(uuid.uuid4())),
+            # version of the session graph the client elements are at, see update_session_graph
+            dcc.Store(id="graph_version", data=0),
+            dbc.Row(
+                [
                     html.Div(
-                        [
-                            dcc.Loading(cyto_graph),
-                            modebar,
-                            info_modal,
-                        ],
-                        className="border border-dark rounded m-4 position-relative",
+                        alerts,
+                        style={"width": "clamp(200px,33vw,500px)", "z-index": "1200"},
+                        className="position-fixed top-0 end-0 m-1 d-flex flex-column",
+                        id="alert-container",
                     ),
-                    md=9,
-                ),
-                dbc.Col(
-                    html.Div(
-                        tabs([add_remove_actor_panel, filter_panel, info_panel], debug=DASH_DEBUG),
-                        className="mt-4 overflow-auto",
+                    dbc.Col(
+                        html.Div(
+                            [
+                                dcc.Loading(cyto_graph),
+                                modebar,
+                                info_modal,
+                            ],
+                            className="border border-dark rounded m-4 position-relative",
+                        ),
+                        md=9,
                     ),
-                    md="3",
-                ),
-            ],
-            align="start",
-        ),
-    ],
-    fluid=True,
-)
+                    dbc.Col(
+                        html.Div(
+                            tabs(
+                                [
+                                    add_remove_actor_panel,
+                                    path_panel,
+                                    filter_panel,
+                                    snapshot_panel,
+                                    info_panel,
+                                ],
+                                debug=DASH_DEBUG,
+                            ),
+                            className="mt-4 overflow-auto",
+                        ),
+                        md="3",
+                    ),
+                ],
+                align="start",
+            ),
+        ],
+        fluid=True,
+    )
 
 
-def rm_node_ids(ids_to_remove, elements, alert_container):
+app.layout = serve_layout
+
+
+def get_session_graph(session_id):
+    return session_store.get(session_id, "graph", GraphState())
+
+
+def update_session_graph(session_id, update_function, client_version, skip_unchanged=False):
+    """Applies update_function(graph) to the session GraphState, returns the Patch
+    replaying the changes on the client elements and the new graph version.
+    Past LOD_MAX_ELEMENTS, returns the level of detail view instead, or the Patch of
+    its data when it still shows the same elements.
+    When client_version is not the version of the graph, the client missed a response
+    or got them out of order, and its elements are replaced as a whole.
+    With skip_unchanged, when no element changed the graph is not stored again,
+    and no_update is returned instead of an empty Patch."""
+    patches = []
+
+    def update(graph):
+        # the filter is stored on its own, see generate_filtered_stylesheet
+        filter_input = session_store.get(session_id, "filter", graph.filter_input)
+        if filter_input != graph.filter_input:
+            graph.set_filter(filter_input)
+        update_function(graph)
+        if graph.layout_options is not None:
+            layout_graph(graph, **graph.layout_options)
+        in_sync = client_version == graph.version
+        if skip_unchanged and in_sync and not graph.has_changes():
+            patches.append((no_update, graph.version))
+            return UNCHANGED
+        patch = graph.flush_patch()
+        if not in_sync:
+            graph.lod_view = None
+        if len(graph) > LOD_MAX_ELEMENTS:
+            graph.lod_active = True
+            patch = level_of_detail_patch(graph, level_of_detail(graph, LOD_MAX_ELEMENTS))
+        elif graph.lod_active:
+            # back under the budget, the client gets the whole graph again
+            graph.lod_active = False
+            graph.expanded_communities = []
+            graph.lod_view = None
+            patch = graph.to_elements()
+        elif not in_sync:
+            patch = graph.to_elements()
+        graph.version += 1
+        patches.append((patch, graph.version))
+        return graph
+
+    session_store.update(session_id, "graph", update, GraphState())
+    return patches[0]
+
+
+def rm_node_ids(ids_to_remove, graph, alert_container):
     """Also removes obsolete edges"""
     alert_accumulator = []
-    previous_elements_length = len(elements)
-    for ele in elements[:]:  # make a copy of elements
-        if ele["data"]["id"] in ids_to_remove:
+    previous_elements_length = len(graph)
+    for node_id in ids_to_remove:
+        if graph.remove_node(node_id):
             # generate alert
-            alert_rm_node = myAlert(
-                f"Successfully removed {ele['data']['id']} from the network.", "success"
-            )
+            alert_rm_node = myAlert(f"Successfully removed {node_id} from the network.", "success")
             alert_accumulator.append(alert_rm_node)
-            # remove node
-            elements.remove(ele)
-        if ele["data"].get("source") in ids_to_remove or ele["data"].get("target") in ids_to_remove:
-            # remove edge
-            elements.remove(ele)
 
-    if len(alert_accumulator) > 8:
+    if len(alert_accumulator) > MAX_ALERTS:
         # prevent display of too many alerts at once
         alert_rm_actors_summary = myAlert(
             f"Successfully removed {len(alert_accumulator)} actors from the graph.", "success"
@@ -353,7 +613,7 @@ def rm_node_ids(ids_to_remove, elements, alert_container):
         # normal display of all alerts
         alert_container += alert_accumulator
 
-    if previous_elements_length == len(elements):
+    if previous_elements_length == len(graph):
         # no actor was removed
         if len(ids_to_remove) == 0:
             one_or_many_message = ""
@@ -369,7 +629,7 @@ def rm_node_ids(ids_to_remove, elements, alert_container):
         )
         alert_container.append(alert_no_removal)
 
-    return elements, alert_container
+    return graph, alert_container
 
 
 @app.callback(
@@ -386,250 +646,477 @@ def toggle_modal(n1, n2, is_open):
 
 @app.callback(
     Output("cyto_graph", "elements", allow_duplicate=True),
+    Output("graph_version", "data", allow_duplicate=True),
     Output("alert-container", "children", allow_duplicate=True),
     Input("actor_add_button", "n_clicks"),
     Input("actor_add", "n_submit"),
     State("actor_add", "value"),
-    State("cyto_graph", "elements"),
-    State("alert-container", "children"),
+    State("graph_version", "data"),
+    State("session_id", "data"),
     prevent_initial_call="initial_duplicate" if DASH_DEBUG else True,
 )
-def add_actor(nclicks, nsubmit, actor, elements, alert_container):
+def add_actor(nclicks, nsubmit, actor, graph_version, session_id):
     """Clicking the green Add btn or pressing the key enter when
     the input is in focus adds the actor to the graph"""
-    query_result = get_actor_relations(actor, database)
+    if not (actor or "").strip():
+        alert_no_actor = myAlert(
+            "No actor was added. Type a name before hitting the button.", "warning"
+        )
+        return no_update, no_update, alert_patch(session_id, [alert_no_actor])
+    query_result = get_actor_relations(actor, database, RELATIONS_MODE)
+    # basic info is only needed if the actor did not play with anyone
+    actor_info = [] if query_result else get_actor_info_basic(actor, database)
+    new_alerts = []
+
+    def add(graph):
+        add_relations(actor, query_result, actor_info, graph, new_alerts)
+
+    patch, version = update_session_graph(session_id, add, graph_version)
+    return patch, version, alert_patch(session_id, new_alerts)
+
+
+def add_duo(duo_data, graph):
+    """Adds both actors of a relation and the edge between them, if not already there"""
+    # sort actors by alphabetical order
+    actor1, actor2 = sorted(
+        [duo_data["main_actor"], duo_data["companion_actor"]], key=lambda x: x["primaryName"]
+    )
+
+    # add actors if not already there
+    for actor_data in (actor1, actor2):
+        if actor_data["primaryName"] not in graph:
+            node_info = {
+                "id": actor_data["primaryName"],
+                "label": actor_data["primaryName"],
+            }
+            node_info.update(actor_data)
+            graph.add_node(node_info)
+
+    # add edge if not already there, movie details are fetched once it is selected
+    graph.add_edge(
+        {
+            "id": f"{actor1['primaryName']} , {actor2['primaryName']}",
+            "source": f"{actor1['primaryName']}",
+            "target": f"{actor2['primaryName']}",
+            "movie_ids": duo_data["movie_ids"],
+        }
+    )
 
-    # make elements iterable if None, e.g. during init
-    if elements is None:
-        elements = []
 
+def add_relations(actor, query_result, actor_info, graph, alert_container):
+    """Adds the actor and its relations from query_result to the graph,
+    or the actor alone from actor_info if query_result is empty"""
     # actor did not play with anyone
     if not query_result:
-        # try to retrieve basic info on actor
-        actor_info = get_actor_info_basic(actor, database)
-
         # check actor exists
         if not actor_info:
             # actor not found
             actor_not_found_alert = myAlert(f"{actor} not found in the database.", "danger")
             alert_container.append(actor_not_found_alert)
-            return elements, alert_container
+            return graph, alert_container
 
         # solo actor
         for actor_entry in actor_info:
-            actor_id = actor_entry["primaryName"]
-            if actor_id not in [ele["data"]["id"] for ele in elements]:
-                node_info = {
-                    "id": actor_entry["primaryName"],
-                    "label": actor_entry["primaryName"],
-                }
-                node_info.update(actor_entry)
-                actor_to_add = {"data": node_info}
-                elements.append(actor_to_add)
+            node_info = {
+                "id": actor_entry["primaryName"],
+                "label": actor_entry["primaryName"],
+                "actor_id": actor_entry["_id"],
+            }
+            node_info.update(actor_entry)
+            # no-op if already there
+            graph.add_node(node_info)
             alert_solo_node = myAlert(f"{actor} added, did not play with anyone else.", "warning")
             alert_container.append(alert_solo_node)
-            return elements, alert_container
+            return graph, alert_container
 
     for duo_data in query_result:
-        # sort actors by alphabetical order
-        actor1, actor2 = sorted(
-            [duo_data["main_actor"], duo_data["companion_actor"]], key=lambda x: x["primaryName"]
-        )
-
-        # add actors if not already there
-        for actor_data in (actor1, actor2):
-            actor_id = actor_data["primaryName"]
-            if actor_id not in [ele["data"]["id"] for ele in elements]:
-                node_info = {
-                    "id": actor_data["primaryName"],
-                    "label": actor_data["primaryName"],
-                }
-                node_info.update(actor_data)
-                actor_to_add = {"data": node_info}
-                elements.append(actor_to_add)
-
-        # add edge if not already there
-        common_movies = duo_data["common_movies"]
-        element_to_add = {
-            "data": {
-                "id": f"{actor1['primaryName']} , {actor2['primaryName']}",
-                "source": f"{actor1['primaryName']}",
-                "target": f"{actor2['primaryName']}",
-                "common_movies": dict(enumerate(common_movies)),
-            }
-        }
-        if element_to_add not in elements:
-            elements.append(element_to_add)
+        add_duo(duo_data, graph)
 
     alert_added_actor = myAlert(
         f"{actor} successfully added. {len(query_result)} connections added, if not already there.",
         "success",
     )
     alert_container.append(alert_added_actor)
-    return elements, alert_container
+    return graph, alert_container
+
+
+def path_summary(relations, movies, stats):
+    """One line per hop with the latest common movie, then the search statistics"""
+    hops = []
+    for duo_data in relations:
+        hop_movies = [movies[movie_id] for movie_id in duo_data["movie_ids"] if movies[movie_id]]
+        if hop_movies:
+            in_movies = movie_string(max(hop_movies, key=movie_sort_key))
+        else:
+            # movies missing from title_basics, only their number is known
+            nb_movies = len(duo_data["movie_ids"])
+            in_movies = f"{nb_movies} movie{'s' if nb_movies > 1 else ''}"
+        hops.append(
+            html.Li(
+                f"{duo_data['main_actor']['primaryName']} and "
+                f"{duo_data['companion_actor']['primaryName']} in {in_movies}"
+            )
+        )
+    source_sizes, target_sizes = stats["frontier_sizes"]
+    return html.Div(
+        [
+            html.Ol(hops, className="mb-1") if hops else "",
+            html.Small(
+                f"{stats['expansions']} actors expanded, {stats['edges_scanned']} edges scanned, "
+                f"frontier sizes {source_sizes} / {target_sizes}, "
+                f"{stats['seconds'] * 1000:.0f} ms",
+                className="text-muted",
+            ),
+        ],
+        className="mt-2",
+    )
 
 
 @app.callback(
     Output("cyto_graph", "elements", allow_duplicate=True),
+    Output("graph_version", "data", allow_duplicate=True),
+    Output("alert-container", "children", allow_duplicate=True),
+    Output("path_info", "children"),
+    Input("path_button", "n_clicks"),
+    Input("path_to", "n_submit"),
+    State("path_from", "value"),
+    State("path_to", "value"),
+    State("graph_version", "data"),
+    State("session_id", "data"),
+    prevent_initial_call=True,
+)
+def add_shortest_path(nclicks, nsubmit, actor, other_actor, graph_version, session_id):
+    """Adds a shortest chain of co-stars between the two actors to the graph, in one go"""
+    if path_graph is None:
+        alert_no_graph = myAlert("Shortest paths need the local graph.", "danger")
+        return no_update, no_update, alert_patch(session_id, [alert_no_graph]), ""
+    unknown = [
+        name or "" for name in [actor, other_actor] if not path_graph.find_actors(name or "")
+    ]
+    if unknown:
+        not_found = " and ".join(f'"{name}"' for name in unknown)
+        alert_unknown = myAlert(f"{not_found} not found in the database.", "danger")
+        return no_update, no_update, alert_patch(session_id, [alert_unknown]), ""
+    relations, stats = get_shortest_path(actor or "", other_actor or "", path_graph)
+    if not relations:
+        if stats["length"] == 0:
+            alert_no_path = myAlert(f"{actor} and {other_actor} are the same actor.", "warning")
+        else:
+            alert_no_path = myAlert(f"No path found between {actor} and {other_actor}.", "warning")
+        alert_no_path = alert_patch(session_id, [alert_no_path])
+        return no_update, no_update, alert_no_path, path_summary(relations, {}, stats)
+    movie_ids = [movie_id for duo_data in relations for movie_id in duo_data["movie_ids"]]
+    movies = get_movies_by_id(movie_ids, database)
+
+    def add(graph):
+        for duo_data in relations:
+            add_duo(duo_data, graph)
+        graph.add_movies(movies.values())
+
+    alert_path = myAlert(f"{actor} and {other_actor} are {len(relations)} hops apart.", "success")
+    patch, version = update_session_graph(session_id, add, graph_version)
+    return (
+        patch,
+        version,
+        alert_patch(session_id, [alert_path]),
+        path_summary(relations, movies, stats),
+    )
+
+
+@app.callback(
+    Output("cyto_graph", "elements", allow_duplicate=True),
+    Output("graph_version", "data", allow_duplicate=True),
     Output("alert-container", "children", allow_duplicate=True),
     Input("btn-rm-all-nodes", "n_clicks"),
-    State("alert-container", "children"),
+    State("graph_version", "data"),
+    State("session_id", "data"),
     prevent_initial_call=True,
 )
-def remove_all_nodes(_, alert_container):
+def remove_all_nodes(_, graph_version, session_id):
+    _, version = update_session_graph(session_id, lambda graph: graph.clear(), graph_version)
     alert_rm_all_actors = myAlert("Successfully removed all actors", "success")
-    alert_container.append(alert_rm_all_actors)
-    return [], alert_container
+    return [], version, alert_patch(session_id, [alert_rm_all_actors])
 
 
 @app.callback(
     Output("cyto_graph", "elements", allow_duplicate=True),
+    Output("graph_version", "data", allow_duplicate=True),
     Output("alert-container", "children", allow_duplicate=True),
     Input("actor_rm_button", "n_clicks"),
     Input("actor_rm", "n_submit"),
     State("actor_rm", "value"),
-    State("cyto_graph", "elements"),
-    State("alert-container", "children"),
+    State("graph_version", "data"),
+    State("session_id", "data"),
     prevent_initial_call=True,
 )
-def rm_actor_from_text(nclicks, nsubmit, actor, elements, alert_container):
+def rm_actor_from_text(nclicks, nsubmit, actor, graph_version, session_id):
     """Clicking the red Remove btn or pressing the key enter when
     the input is in focus removes the actor from the graph"""
     actor_list = [actor] if actor is not None else []
-    return rm_node_ids(actor_list, elements, alert_container)
+    new_alerts = []
+    patch, version = update_session_graph(
+        session_id, lambda graph: rm_node_ids(actor_list, graph, new_alerts), graph_version
+    )
+    return patch, version, alert_patch(session_id, new_alerts)
 
 
 @app.callback(
     Output("cyto_graph", "elements", allow_duplicate=True),
+    Output("graph_version", "data", allow_duplicate=True),
     Output("alert-container", "children", allow_duplicate=True),
     Input("btn-rm-selected-nodes", "n_clicks"),
     State("cyto_graph", "selectedNodeData"),
-    State("cyto_graph", "elements"),
-    State("alert-container", "children"),
+    State("graph_version", "data"),
+    State("session_id", "data"),
     prevent_initial_call=True,
 )
-def rm_selected_nodes(_, selected_nodes, elements, alert_container):
+def rm_selected_nodes(_, selected_nodes, graph_version, session_id):
     if not selected_nodes:
         ids_to_remove = []
         alert_no_selected_actor = myAlert(
             "No actor was removed from the network. Select a node before hitting the button.",
             "warning",
         )
-        alert_container.append(alert_no_selected_actor)
-        return elements, alert_container
+        return no_update, no_update, alert_patch(session_id, [alert_no_selected_actor])
     else:
         ids_to_remove = [node["id"] for node in selected_nodes]
-        return rm_node_ids(ids_to_remove, elements, alert_container)
+        new_alerts = []
+        # a selected community stands for all its actors
+        patch, version = update_session_graph(
+            session_id,
+            lambda graph: rm_node_ids(member_ids(ids_to_remove, graph), graph, new_alerts),
+            graph_version,
+        )
+        return patch, version, alert_patch(session_id, new_alerts)
 
 
 @app.callback(
+    Output("snapshot_download", "data"),
+    Output("snapshot_id", "value"),
+    Output("alert-container", "children", allow_duplicate=True),
+    Input("snapshot_save_button", "n_clicks"),
+    State("session_id", "data"),
+    prevent_initial_call=True,
+)
+def save_snapshot(_, session_id):
+    """Downloads the graph snapshot, also kept server-side under a shareable id"""
+    snapshot = dump_snapshot(get_session_graph(session_id))
+    snapshot_id = snapshot_store.put(snapshot)
+    alert_saved = myAlert(f"Snapshot {snapshot_id} saved, open it again with this id.", "success")
+    return (
+        dcc.send_bytes(snapshot, f"costars-{snapshot_id}.snapshot"),
+        snapshot_id,
+        alert_patch(session_id, [alert_saved]),
+    )
+
+
+@app.callback(
+    Output("cyto_graph", "elements", allow_duplicate=True),
+    Output("graph_version", "data", allow_duplicate=True),
+    Output("alert-container", "children", allow_duplicate=True),
+    Input("snapshot_upload", "contents"),
+    Input("snapshot_open_button", "n_clicks"),
+    Input("snapshot_id", "n_submit"),
+    State("snapshot_id", "value"),
+    State("graph_version", "data"),
+    State("session_id", "data"),
+    prevent_initial_call=True,
+)
+def open_snapshot(contents, nclicks, nsubmit, snapshot_id, graph_version, session_id):
+    """Replaces the graph by an uploaded snapshot or a saved one, without database queries"""
+    if ctx.triggered_id == "snapshot_upload":
+        # data URL of the uploaded file
+        snapshot = base64.b64decode(contents.split(",", 1)[1])
+    else:
+        snapshot = snapshot_store.get((snapshot_id or "").strip())
+        if snapshot is None:
+            alert_not_found = myAlert(f"Snapshot {snapshot_id} not found.", "danger")
+            return no_update, no_update, alert_patch(session_id, [alert_not_found])
+
+    loaded = []
+
+    def load(graph):
+        load_snapshot(snapshot, graph)
+        loaded.append(graph)
+
+    try:
+        elements, version = update_session_graph(session_id, load, graph_version)
+    except ValueError:
+        alert_invalid = myAlert("This file is not a graph snapshot.", "danger")
+        return no_update, no_update, alert_patch(session_id, [alert_invalid])
+    if isinstance(elements, Patch):
+        # the client elements are replaced as a whole
+        elements = client_elements(loaded[0])
+    graph = loaded[0]
+    alert_loaded = myAlert(
+        f"Snapshot opened, {len(graph.adjacency)} actors and "
+        f"{len(graph) - len(graph.adjacency)} connections.",
+        "success",
+    )
+    return elements, version, alert_patch(session_id, [alert_loaded])
+
+
+@app.callback(
+    Output("cyto_graph", "elements", allow_duplicate=True),
+    Output("graph_version", "data", allow_duplicate=True),
     Output("cyto_graph", "stylesheet", allow_duplicate=True),
     Input("actor_filter", "value"),
-    State("cyto_graph", "elements"),
+    State("graph_version", "data"),
+    State("session_id", "data"),
     prevent_initial_call=True,
 )
-def generate_filtered_stylesheet(filter_input, elements):
-    if not filter_input:
-        return default_stylesheet
-    nodes = get_nodes(elements)
-    edges = get_edges(elements)
-    filtered_nodes = [
-        node["data"]["id"] for node in nodes if filter_input.lower() in node["data"]["id"].lower()
-    ]
-    filtered_edges = [
-        edge["data"]["id"]
-        for edge in edges
-        if any(
-            filtered_node in (edge["data"]["source"], edge["data"]["target"])
-            for filtered_node in filtered_nodes
-        )
-    ]
-    stylesheet = default_stylesheet.copy()
-    off_stylesheet = [
-        {"selector": "node", "style": {"opacity": 0.3}},
-        {
-            "selector": "edge",
-            "style": {
-                "opacity": 0.2,
-            },
-        },
-    ]
-    on_stylesheet_nodes = [
-        {"selector": f"node[id = '{node_id}']", "style": {"opacity": 1, "z-index": 10}}
-        for node_id in filtered_nodes
-    ]
-    on_stylesheet_edges = [
-        {"selector": f"edge[id = '{edge_id}']", "style": {"opacity": 1, "z-index": 9}}
-        for edge_id in filtered_edges
-    ]
-    stylesheet = stylesheet + off_stylesheet + on_stylesheet_nodes + on_stylesheet_edges
-
-    return stylesheet
+def generate_filtered_stylesheet(filter_input, graph_version, session_id):
+    """Flags matching elements with data(filtered), the stylesheet itself
+    only changes when the filter is switched on or off.
+    The filter is stored apart from the graph, which is only stored again when
+    the flags of some elements changed, not on every keystroke."""
+    previous_filter, _ = session_store.update(session_id, "filter", lambda _: filter_input)
+    # update_session_graph applies the stored filter
+    patch, version = update_session_graph(
+        session_id, lambda graph: None, graph_version, skip_unchanged=True
+    )
+    if bool(filter_input) == bool(previous_filter):
+        return patch, version, no_update
+    if filter_input:
+        return patch, version, default_stylesheet + filter_stylesheet
+    return patch, version, default_stylesheet
 
 
 @app.callback(
     Output("cyto_graph", "elements", allow_duplicate=True),
+    Output("graph_version", "data", allow_duplicate=True),
     Output("alert-container", "children", allow_duplicate=True),
     Input("btn-add-random-actor", "n_clicks"),
-    State("cyto_graph", "elements"),
-    State("alert-container", "children"),
+    State("graph_version", "data"),
+    State("session_id", "data"),
     prevent_initial_call=True,
 )
-def add_random_actor(_, elements, alert_container):
-    random_actor = get_random_actor(database)
-    elements, alert_container = add_actor(None, None, random_actor, elements, alert_container)
-    return elements, alert_container
+def add_random_actor(_, graph_version, session_id):
+    random_actor = get_random_actor(database, actor_sampler)
+    return add_actor(None, None, random_actor, graph_version, session_id)
 
 
 @app.callback(
     Output("cyto_graph", "elements", allow_duplicate=True),
+    Output("graph_version", "data", allow_duplicate=True),
     Output("alert-container", "children", allow_duplicate=True),
     Input("btn-expand-seleted-nodes", "n_clicks"),
     State("cyto_graph", "selectedNodeData"),
-    State("cyto_graph", "elements"),
-    State("alert-container", "children"),
+    State("graph_version", "data"),
+    State("session_id", "data"),
     prevent_initial_call=True,
 )
-def expand_selected_actors(_, data_nodes, elements, alert_container):
+def expand_selected_actors(_, data_nodes, graph_version, session_id):
+    # communities are expanded by clicking them
+    data_nodes = [data_element for data_element in data_nodes or [] if "actor_id" in data_element]
     # no actor was selected
     if not data_nodes:
         alert_no_selected_actor = myAlert(
             "No actor was added to the network. Select a node before hitting the button.", "warning"
         )
-        alert_container.append(alert_no_selected_actor)
-        return elements, alert_container
+        return no_update, no_update, alert_patch(session_id, [alert_no_selected_actor])
+
+    # else add all selected actors, querying their relations by IMDb id in one batch
+    actor_ids = [data_element["actor_id"] for data_element in data_nodes]
+    actors_relations = get_actors_relations_by_id(actor_ids, database, RELATIONS_MODE)
+    actors_info = {
+        actor_id: get_actor_info_by_id(actor_id, database)
+        for actor_id, query_result in actors_relations.items()
+        if not query_result
+    }
+    new_alerts = []
+
+    def expand(graph):
+        for data_element in data_nodes:
+            actor, actor_id = data_element["id"], data_element["actor_id"]
+            add_relations(
+                actor,
+                actors_relations[actor_id],
+                actors_info.get(actor_id, []),
+                graph,
+                new_alerts,
+            )
 
-    # else add all selected actors
-    for data_element in data_nodes:
-        actor = data_element["id"]
-        elements, alert_container = add_actor(None, None, actor, elements, alert_container)
-    return elements, alert_container
+    patch, version = update_session_graph(session_id, expand, graph_version)
+    return patch, version, alert_patch(session_id, new_alerts)
 
 
 @app.callback(
     Output("cyto_graph", "elements", allow_duplicate=True),
+    Output("graph_version", "data", allow_duplicate=True),
     Output("alert-container", "children", allow_duplicate=True),
     Input("btn-rm-lonely-nodes", "n_clicks"),
-    State("cyto_graph", "elements"),
-    State("alert-container", "children"),
+    State("graph_version", "data"),
+    State("session_id", "data"),
     prevent_initial_call=True,
 )
-def remove_lonely_actors(_, elements, alert_container):
-    degrees = get_degrees(elements)
-    lonely_nodes_ids = [id for id, deg in degrees.items() if deg == 0]
-    return rm_node_ids(lonely_nodes_ids, elements, alert_container)
+def remove_lonely_actors(_, graph_version, session_id):
+    new_alerts = []
+
+    def rm_lonely_nodes(graph):
+        rm_node_ids(list(graph.lonely), graph, new_alerts)
+
+    patch, version = update_session_graph(session_id, rm_lonely_nodes, graph_version)
+    return patch, version, alert_patch(session_id, new_alerts)
+
+
+@app.callback(
+    Output("cyto_graph", "elements", allow_duplicate=True),
+    Output("graph_version", "data", allow_duplicate=True),
+    Output("alert-container", "children", allow_duplicate=True),
+    Input("cyto_graph", "tapNodeData"),
+    State("graph_version", "data"),
+    State("session_id", "data"),
+    prevent_initial_call=True,
+)
+def expand_community(data_node, graph_version, session_id):
+    """Clicking a community shows its actors, if they fit within LOD_MAX_ELEMENTS"""
+    if not data_node or not is_community(data_node["id"]):
+        return no_update, no_update, no_update
+
+    def expand(graph):
+        graph.expanded_communities.append(data_node["community"])
+
+    patch, version = update_session_graph(session_id, expand, graph_version)
+    # level_of_detail drops the communities that do not fit
+    if data_node["community"] not in get_session_graph(session_id).expanded_communities:
+        alert_too_large = myAlert(
+            f"{data_node['label']} is too large to show, collapse other communities first.",
+            "warning",
+        )
+        return patch, version, alert_patch(session_id, [alert_too_large])
+    return patch, version, no_update
+
+
+@app.callback(
+    Output("cyto_graph", "elements", allow_duplicate=True),
+    Output("graph_version", "data", allow_duplicate=True),
+    Input("btn-collapse-communities", "n_clicks"),
+    State("graph_version", "data"),
+    State("session_id", "data"),
+    prevent_initial_call=True,
+)
+def collapse_communities(_, graph_version, session_id):
+    def collapse(graph):
+        graph.expanded_communities = []
+
+    return update_session_graph(session_id, collapse, graph_version)
 
 
 @app.callback(
     Output("node_info", "children"),
     Input("cyto_graph", "selectedNodeData"),
-    State("cyto_graph", "elements"),
+    State("session_id", "data"),
     prevent_initial_call=True,
 )
-def displayNodeData(data_nodes, elements):
+def displayNodeData(data_nodes, session_id):
+    graph = get_session_graph(session_id)
     full_data = []
     for data_element in data_nodes:
-        single_element_info = get_single_node_info(data_element, elements)
+        if "members" in data_element:
+            single_element_info = get_community_info(data_element, graph)
+        else:
+            single_element_info = get_single_node_info(data_element, graph)
         full_data.append(single_element_info)
     return html.Div(full_data)
 
@@ -637,17 +1124,45 @@ def displayNodeData(data_nodes, elements):
 @app.callback(
     Output("edge_info", "children"),
     Input("cyto_graph", "selectedEdgeData"),
-    State("cyto_graph", "elements"),
+    State("session_id", "data"),
     prevent_initial_call=True,
 )
-def displayEdgeData(data_edges, elements):
+def displayEdgeData(data_edges, session_id):
+    graph = get_session_graph(session_id)
+    missing_movie_ids = graph.missing_movies([data_element["id"] for data_element in data_edges])
+    if missing_movie_ids:
+        # one batched lookup for the selected edges, kept in the session movie table
+        movies = get_movies_by_id(missing_movie_ids, database).values()
+
+        def add_movies(graph):
+            graph.add_movies(movies)
+            return graph
+
+        _, graph = session_store.update(session_id, "graph", add_movies, GraphState())
     full_data = []
     for data_element in data_edges:
-        single_element_info = get_single_edge_info(data_element, elements)
+        if "weight" in data_element:
+            single_element_info = get_aggregate_edge_info(data_element)
+        else:
+            single_element_info = get_single_edge_info(data_element, graph)
         full_data.append(single_element_info)
     return html.Div(full_data)
 
 
+def update_suggestions(query):
+    if typeahead_index is None or not query:
+        return []
+    return [html.Option(value=name) for name in typeahead_index.suggest(query)]
+
+
+for input_id in ["actor_add", "actor_rm", "actor_filter", "path_from", "path_to"]:
+    app.callback(
+        Output(f"{input_id}_suggestions", "children"),
+        Input(input_id, "value"),
+        prevent_initial_call=True,
+    )(update_suggestions)
+
+
 generic_parameters = ["name", "animate", "animationDuration", "fit", "padding"]
 
 
@@ -692,6 +1207,27 @@ for layout_name in layout_filters.keys():
     )(update_cytoscape_layout_generic)
 
 
+@app.callback(
+    Output(cyto_graph, "elements", allow_duplicate=True),
+    Output("graph_version", "data", allow_duplicate=True),
+    Input(cyto_graph, "layout"),
+    State("graph_version", "data"),
+    State("session_id", "data"),
+    prevent_initial_call=True,
+)
+def update_server_layout(layout, graph_version, session_id):
+    """With the preset layout, node positions are computed server-side, see layout.py"""
+    options = layout_options(layout)
+
+    def set_layout_options(graph):
+        if graph.layout_options is None and options is not None:
+            # positions left over from a previous server-side layout are stale
+            graph.reset_positions()
+        graph.layout_options = options
+
+    return update_session_graph(session_id, set_layout_options, graph_version)
+
+
 @app.callback(
     Output("copy_paste_layout", "content"),
     Input("copy_paste_layout", "n_clicks"),
@@ -701,19 +1237,91 @@ def custom_copy(_, layout_dict):
     return str(layout_dict)
 
 
-def update_debug_panel(elements):
-    return json.dumps(elements, indent=2, ensure_ascii=False)
+def client_elements(graph):
+    """Elements as the client holds them, whole graph or level of detail view"""
+    if graph.lod_active:
+        return level_of_detail(graph, LOD_MAX_ELEMENTS)
+    return graph.to_elements()
+
+
+def debug_element_list(label, elements):
+    """Collapsible list of element ids, their JSON is fetched on click"""
+    return html.Details(
+        [
+            html.Summary(f"{label} ({len(elements)})"),
+            *[
+                html.Button(
+                    element["data"]["id"],
+                    id={"type": "debug-element", "index": element["data"]["id"]},
+                    className="btn btn-link btn-sm d-block p-0 text-start",
+                )
+                for element in elements
+            ],
+        ],
+        open=True,
+    )
+
 
+@app.callback(
+    Output("debug-summary", "children"),
+    Output("debug-elements", "children"),
+    Output("debug-page", "max_value"),
+    Input("tabs", "value"),
+    Input("debug-refresh", "n_clicks"),
+    Input("debug-page", "active_page"),
+    State("session_id", "data"),
+)
+def update_debug_inspector(tab, _, page, session_id):
+    # reads the session graph rather than the client elements, and only while visible
+    if tab != "tab-2":
+        return no_update, no_update, no_update
+    graph = get_session_graph(session_id)
+    nb_nodes = len(graph.adjacency)
+    payload_bytes = len(json.dumps(client_elements(graph), ensure_ascii=False).encode())
+    summary = (
+        f"{nb_nodes} nodes, {len(graph) - nb_nodes} edges, {len(graph.movies)} movies, "
+        f"{len(graph.filtered)} filtered, {payload_bytes / 1024:.1f} kB on the client"
+    )
+    if graph.lod_active:
+        summary += f" (level of detail, {len(get_communities(graph))} communities)"
+
+    nb_pages = max(1, -(-len(graph) // DEBUG_PAGE_SIZE))
+    page = min(page or 1, nb_pages)
+    page_elements = graph.elements[(page - 1) * DEBUG_PAGE_SIZE : page * DEBUG_PAGE_SIZE]
+    element_lists = [
+        debug_element_list(
+            "Nodes", [element for element in page_elements if "source" not in element["data"]]
+        ),
+        debug_element_list(
+            "Edges", [element for element in page_elements if "source" in element["data"]]
+        ),
+    ]
+    return summary, element_lists, nb_pages
 
-info_debug_func = app.callback(Output("debug-info", "children"), Input(cyto_graph, "elements"))(
-    update_debug_panel
+
+@app.callback(
+    Output("debug-info-element", "children"),
+    Input({"type": "debug-element", "index": ALL}, "n_clicks"),
+    Input(cyto_graph, "selectedNodeData"),
+    Input(cyto_graph, "selectedEdgeData"),
+    State("tabs", "value"),
+    State("session_id", "data"),
+    prevent_initial_call=True,
 )
-node_debug_func = app.callback(
-    Output("debug-info-node", "children"), Input(cyto_graph, "selectedNodeData")
-)(update_debug_panel)
-edge_debug_func = app.callback(
-    Output("debug-info-edge", "children"), Input(cyto_graph, "selectedEdgeData")
-)(update_debug_panel)
+def show_debug_element(_, data_nodes, data_edges, tab, session_id):
+    """JSON of the clicked element, or of the selected elements"""
+    if tab != "tab-2" or not ctx.triggered[0]["value"]:
+        return no_update
+    if isinstance(ctx.triggered_id, dict):
+        data_elements = [{"id": ctx.triggered_id["index"]}]
+    else:
+        data_elements = (data_nodes or []) + (data_edges or [])
+    graph = get_session_graph(session_id)
+    # community nodes and aggregate edges only exist on the client
+    elements = [
+        graph.get(data_element["id"]) or {"data": data_element} for data_element in data_elements
+    ]
+    return json.dumps(elements, indent=2, ensure_ascii=False)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,329 @@
+"""Benchmark the callback and query hot paths on a synthetic co-star graph.
+
+    python bench.py [--sizes 10,100,1000,10000] [--repeat 5] [--save]
+
+The graph is generated with power-law actor popularity and realistic cast sizes, then
+written with write_local_graph so that the local backend stands in for MongoDB.
+Callbacks are invoked in-process on session graphs of each size. The MongoDB pipelines
+of queries.py run on a smaller synthetic graph loaded in mongomock, if installed.
+Their time, peak allocations and payload bytes are compared with the baseline in
+bench_baseline.json.
+"""
+
+import argparse
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+
+import numpy as np
+from plotly.utils import PlotlyJSONEncoder
+
+import local_graph
+import queries
+from build_edges import build_actor_edges
+from formatting import normalize_name
+from utils import GraphState, get_degrees
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+BASELINE_PATH = "bench_baseline.json"
+SIZES = [10, 100, 1000, 10_000]
+REPEAT = 5
+# slower or heavier than the baseline by more than this factor is a regression, times
+# also need to exceed the spread of the repeats of both runs
+TOLERANCE = 1.25
+# same synthetic graph whatever the sizes benched, so that results stay comparable,
+# with enough actors for the largest session graph
+SYNTHETIC_ACTORS = 3 * max(SIZES)
+MOVIES_PER_ACTOR = 2
+# Zipf exponent of actor popularity, gives power-law degrees
+POPULARITY_EXPONENT = 0.8
+# actors credited per movie, IMDb principals list a handful of them
+MIN_CAST, MAX_CAST, MEAN_CAST = 2, 10, 4
+# mongomock scans whole collections for each $lookup, hence a smaller graph
+MONGO_ACTORS = 2000
+# actors queried by the $in batch, by popularity rank
+MONGO_BATCH = range(100, 104)
+
+first_names = ["Ada", "Bruno", "Chloé", "Dev", "Elena", "Farid", "Grace", "Hugo", "Inès", "Jun"]
+last_names = ["Moreau", "Okafor", "Smith", "Tanaka", "Ivanova", "García", "Kowalski", "Núñez"]
+
+
+def synthetic_data(nb_actors, seed=0):
+    """name_basics and title_basics documents and (movie id, actor id) credits of
+    nb_actors actors, the most popular ones play in most movies"""
+    rng = np.random.default_rng(seed)
+    actors = [
+        {
+            "_id": f"nm{i:07d}",
+            "primaryName": f"{first_names[i % 10]} {last_names[i // 10 % 8]} {i // 80}",
+            "birthYear": int(rng.integers(1930, 2005)),
+            "deathYear": None,
+            "primaryProfession": "actress" if i % 2 else "actor",
+        }
+        for i in range(nb_actors)
+    ]
+    nb_movies = nb_actors * MOVIES_PER_ACTOR
+    movies = [
+        {
+            "_id": f"tt{i:07d}",
+            "primaryTitle": f"Movie {i}",
+            "originalTitle": f"Movie {i}",
+            "releaseYear": int(rng.integers(1950, 2024)),
+            "runtimeMinutes": int(rng.integers(70, 180)),
+            "genres": "Drama",
+        }
+        for i in range(nb_movies)
+    ]
+    popularity = np.arange(1, nb_actors + 1, dtype=np.float64) ** -POPULARITY_EXPONENT
+    popularity /= popularity.sum()
+    cast_sizes = np.clip(rng.poisson(MEAN_CAST, nb_movies), MIN_CAST, MAX_CAST)
+    principals = [
+        (f"tt{movie:07d}", f"nm{actor:07d}")
+        for movie, cast_size in enumerate(cast_sizes)
+        for actor in rng.choice(nb_actors, size=cast_size, replace=False, p=popularity)
+    ]
+    return actors, movies, principals
+
+
+def synthetic_graph(path, nb_actors, seed=0):
+    """Writes the local graph of synthetic_data"""
+    local_graph.write_local_graph(path, *synthetic_data(nb_actors, seed))
+
+
+def mongo_stand_in(nb_actors, seed=0):
+    """mongomock database of synthetic_data, with the actor_edges collection built"""
+    actors, movies, principals = synthetic_data(nb_actors, seed)
+    db = mongomock.MongoClient().db
+    db["name_basics"].insert_many(actors)
+    db["title_basics"].insert_many(movies)
+    db["title_principal"].insert_many(
+        [
+            {"movie_id": movie_id, "actor_id": actor_id, "category": "actor"}
+            for movie_id, actor_id in principals
+        ]
+    )
+    build_actor_edges(db)
+    return db
+
+
+def payload_bytes(output):
+    """Size of the callback output as sent to the client"""
+    return len(json.dumps(output, cls=PlotlyJSONEncoder).encode())
+
+
+def grow_graph(app, session_id, nb_nodes):
+    """Session graph of exactly nb_nodes actors, grown co-star by co-star from the most
+    popular actor, as a user expanding the graph would. Returns the actors not expanded yet."""
+    graph = GraphState()
+    queue, seen = deque(["Ada Moreau 0"]), {"Ada Moreau 0"}
+    while len(graph.adjacency) < nb_nodes and queue:
+        actor = queue.popleft()
+        for duo_data in local_graph.get_actor_relations(actor, app.database):
+            if len(graph.adjacency) >= nb_nodes:
+                break
+            app.add_duo(duo_data, graph)
+            companion = duo_data["companion_actor"]["primaryName"]
+            if companion not in seen:
+                seen.add(companion)
+                queue.append(companion)
+    graph.flush_patch()
+    app.session_store.set(session_id, "graph", graph)
+    # the client view, whole graph or level of detail, as after the last callback,
+    # a client without any version receives it as a whole
+    app.update_session_graph(session_id, lambda graph: None, None)
+    return [actor for actor in queue if actor in graph]
+
+
+def measure(run, reset, repeat):
+    """Median and spread (max - min) of the time over repeat runs after a warm-up run,
+    peak allocations of one more run and payload bytes of its output.
+    reset restores the session before every run."""
+    reset()
+    run()
+    seconds = []
+    for _ in range(repeat):
+        reset()
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+    reset()
+    tracemalloc.start()
+    output = run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "ms": round(float(np.median(seconds)) * 1000, 3),
+        "ms_spread": round((max(seconds) - min(seconds)) * 1000, 3),
+        "peak_kib": round(peak / 1024, 1),
+        "payload_bytes": payload_bytes(output),
+    }
+
+
+def bench_size(app, nb_nodes, repeat):
+    session_id = f"bench-{nb_nodes}"
+    frontier = grow_graph(app, session_id, nb_nodes)
+    graph = app.get_session_graph(session_id)
+    snapshot = pickle.dumps(graph)
+
+    def reset():
+        app.session_store.set(session_id, "graph", pickle.loads(snapshot))
+        app.session_store.set(session_id, "filter", None)
+
+    node_ids = list(graph.adjacency)
+    hub = max(node_ids, key=graph.degree)
+    newcomer = frontier[0] if frontier else node_ids[-1]
+    edges = [element["data"] for element in graph.elements if "source" in element["data"]]
+    query = normalize_name(node_ids[len(node_ids) // 2])[:4]
+    # the client is in sync, callbacks send patches
+    version = graph.version
+
+    runs = {
+        "add_actor": lambda: app.add_actor(None, None, newcomer, version, session_id),
+        "expand_selected_actors": lambda: app.expand_selected_actors(
+            None, [graph.get(newcomer)["data"]], version, session_id
+        ),
+        "rm_node_ids": lambda: app.rm_actor_from_text(None, None, hub, version, session_id),
+        "generate_filtered_stylesheet": lambda: app.generate_filtered_stylesheet(
+            query, version, session_id
+        ),
+        "get_single_edge_info": lambda: app.displayEdgeData(edges[:10], session_id),
+        "get_degrees": lambda: get_degrees(graph.elements),
+        "get_actor_relations": lambda: local_graph.get_actor_relations(newcomer, app.database),
+    }
+    results = {}
+    for name, run in runs.items():
+        results[name] = measure(run, reset, repeat)
+        print(f"{row_label(str(nb_nodes))} {name:<28} {format_result(results[name])}", flush=True)
+    return results
+
+
+def bench_mongo(repeat):
+    """Both relations pipelines, for one actor and for an $in batch. Actors are selected
+    by id as mongomock does not implement $text, the stages after the selection are the
+    same as for get_actor_relations."""
+    start = time.perf_counter()
+    db = mongo_stand_in(MONGO_ACTORS)
+    print(f"mongomock stand-in loaded in {time.perf_counter() - start:.1f} s", flush=True)
+    actor_ids = [f"nm{rank:07d}" for rank in MONGO_BATCH]
+    runs = {}
+    for mode, pipeline in [("aggregate", "giga_query"), ("edges", "edges_query")]:
+        runs[pipeline] = lambda mode=mode: queries.get_actors_relations_by_id(
+            actor_ids[:1], db, mode
+        )
+        runs[f"{pipeline}_batch"] = lambda mode=mode: queries.get_actors_relations_by_id(
+            actor_ids, db, mode
+        )
+    results = {}
+    for name, run in runs.items():
+        results[name] = measure(run, lambda: None, repeat)
+        print(f"{row_label('mongomock')} {name:<28} {format_result(results[name])}", flush=True)
+    return results
+
+
+def row_label(size):
+    return f"{size:>6} nodes" if size.isdigit() else f"{size:>12}"
+
+
+def format_result(result):
+    return (
+        f"{result['ms']:>10.2f} ms {result['peak_kib']:>10.1f} KiB "
+        f"{result['payload_bytes']:>10} bytes"
+    )
+
+
+def is_worse(metric, value, previous, tolerance):
+    """Whether value is a regression, or with the roles swapped an improvement, from previous,
+    both results of measure. Payloads are deterministic, times and allocations are noisy."""
+    if metric == "payload_bytes":
+        return value[metric] > previous[metric]
+    allowed = previous[metric] * tolerance
+    if metric == "ms":
+        allowed += previous.get("ms_spread", 0) + value.get("ms_spread", 0)
+    return value[metric] > allowed
+
+
+def compare(results, baseline, tolerance):
+    """Prints the changes against the baseline beyond noise, returns the number of regressions.
+    Only slower, heavier or larger results are regressions, improvements are printed as is."""
+    regressions = 0
+    for size, operations in results.items():
+        for name, result in operations.items():
+            previous = baseline.get(size, {}).get(name)
+            if previous is None:
+                print(f"{row_label(size)} {name:<28} new")
+                continue
+            changes = []
+            for metric in ["ms", "peak_kib", "payload_bytes"]:
+                worse = is_worse(metric, result, previous, tolerance)
+                if not worse and not is_worse(metric, previous, result, tolerance):
+                    continue
+                regressions += worse
+                ratio = result[metric] / previous[metric] if previous[metric] else float("inf")
+                flag = " REGRESSION" if worse else ""
+                changes.append(
+                    f"{metric} {previous[metric]} -> {result[metric]} (x{ratio:.2f}){flag}"
+                )
+            if changes:
+                print(f"{row_label(size)} {name:<28} " + ", ".join(changes))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)))
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--save", action="store_true", help="overwrite the baseline")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    # a throwaway local graph, sessions and caches, set before the app reads them,
+    # a .env file still takes precedence as the app loads it with override=True
+    work_dir = tempfile.mkdtemp(prefix="bench_")
+    graph_path = os.path.join(work_dir, "local_graph")
+    start = time.perf_counter()
+    synthetic_graph(graph_path, SYNTHETIC_ACTORS)
+    print(f"synthetic graph written in {time.perf_counter() - start:.1f} s to {graph_path}")
+    os.environ.update(
+        {
+            "GRAPH_BACKEND": "local",
+            "LOCAL_GRAPH_PATH": graph_path,
+            "SESSION_PATH": os.path.join(work_dir, "sessions.sqlite3"),
+            "CACHE_PATH": os.path.join(work_dir, "cache.sqlite3"),
+            "MOVIES_CACHE_PATH": os.path.join(work_dir, "movies_cache.sqlite3"),
+            "SNAPSHOT_PATH": os.path.join(work_dir, "snapshots.sqlite3"),
+        }
+    )
+    import app
+
+    results = {str(size): bench_size(app, size, args.repeat) for size in sizes}
+    if mongomock is not None:
+        results["mongomock"] = bench_mongo(args.repeat)
+    else:
+        print("mongomock is not installed, the MongoDB pipelines are not benched")
+
+    if args.save or not os.path.exists(args.baseline):
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write("\n")
+        print(f"baseline written to {args.baseline}")
+        return 0
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare(results, baseline, args.tolerance)
+    print(f"{regressions} regression(s) against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+"""Offline build of the actor_edges collection used by get_actor_relations(mode="edges").
+
+One document per actor pair (source < target) holding the ids of their common movies.
+Run once after (re)loading title_principal:
+
+    python build_edges.py
+"""
+
+import time
+
+from pymongo import ASCENDING
+
+actor_edges_build_query = [
+    {"$group": {"_id": "$movie_id", "actor_ids": {"$addToSet": "$actor_id"}}},
+    # movies with a single credited actor do not produce any pair
+    {"$match": {"actor_ids.1": {"$exists": True}}},
+    {"$project": {"source": "$actor_ids", "target": "$actor_ids"}},
+    {"$unwind": "$source"},
+    {"$unwind": "$target"},
+    # keep each unordered pair once
+    {"$match": {"$expr": {"$lt": ["$source", "$target"]}}},
+    {
+        "$group": {
+            "_id": {"source": "$source", "target": "$target"},
+            "movie_ids": {"$push": "$_id"},
+            "count": {"$sum": 1},
+        }
+    },
+    {
+        "$project": {
+            "_id": 0,
+            "source": "$_id.source",
+            "target": "$_id.target",
+            "movie_ids": 1,
+            "count": 1,
+        }
+    },
+    {"$out": "actor_edges"},
+]
+
+
+def build_actor_edges(db):
+    db["title_principal"].aggregate(actor_edges_build_query, allowDiskUse=True)
+    db["actor_edges"].create_index([("source", ASCENDING)])
+    db["actor_edges"].create_index([("target", ASCENDING)])
+    return db["actor_edges"].estimated_document_count()
+
+
+if __name__ == "__main__":
+    from db import database
+
+    start = time.perf_counter()
+    nb_edges = build_actor_edges(database)
+    print(f"Built {nb_edges} actor edges in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,222 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+import dotenv
+
+from formatting import normalize_name
+
+dotenv.load_dotenv(override=True)
+
+CACHE_PATH = os.getenv("CACHE_PATH", "cache.sqlite3")
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_MB", "256")) * 2**20
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", str(24 * 3600)))
+MOVIES_CACHE_PATH = os.getenv("MOVIES_CACHE_PATH", "movies_cache.sqlite3")
+# hits only move an entry up the LRU order once it was last accessed this long ago
+ACCESS_REFRESH_SECONDS = 60
+# hit and miss counts are kept by each worker and added to the file this often
+COUNTER_FLUSH_SECONDS = 10
+
+cache_schema = [
+    """CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        created REAL NOT NULL,
+        accessed REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)",
+    "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+]
+counter_names = ["hits", "misses", "evictions"]
+
+
+class SQLiteStore:
+    """SQLite file shared by every gunicorn worker on the machine"""
+
+    schema = []
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        connection = self._connection()
+        for statement in self.schema:
+            connection.execute(statement)
+
+    def _connection(self):
+        # one connection per thread and per process (workers are forked)
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction, taken upfront so that read-modify-write sequences are atomic"""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+
+class SharedCache(SQLiteStore):
+    """LRU cache with a byte budget and a TTL, shared between workers.
+    Hits do not write to the file, except for the occasional access time and counters."""
+
+    schema = cache_schema
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL_SECONDS):
+        super().__init__(path)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._pending_counts = dict.fromkeys(counter_names, 0)
+        self._pending_lock = threading.Lock()
+        self._flushed = time.time()
+        self._pid = os.getpid()
+
+    def _count(self, connection, name, increment=1):
+        connection.execute(
+            "INSERT INTO counters VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?",
+            (name, increment, increment),
+        )
+
+    def _take_counts(self):
+        """Counts pending in this worker, reset, under _pending_lock"""
+        pending, self._pending_counts = self._pending_counts, dict.fromkeys(counter_names, 0)
+        if self._pid != os.getpid():
+            # forked worker, the parent counts are its own to flush
+            self._pid = os.getpid()
+            return self._pending_counts.copy()
+        return pending
+
+    def _count_later(self, name):
+        with self._pending_lock:
+            if self._pid != os.getpid():
+                self._take_counts()
+            self._pending_counts[name] += 1
+        if time.time() - self._flushed > COUNTER_FLUSH_SECONDS:
+            self._flush_counts(self._connection())
+
+    def _flush_counts(self, connection):
+        with self._pending_lock:
+            pending = self._take_counts()
+            self._flushed = time.time()
+        for name, increment in pending.items():
+            if increment:
+                self._count(connection, name, increment)
+
+    def get(self, key):
+        """Returns (found, value)"""
+        connection = self._connection()
+        now = time.time()
+        row = connection.execute(
+            "SELECT value, created, accessed FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            if row is not None:
+                connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._count_later("misses")
+            return False, None
+        if now - row[2] > ACCESS_REFRESH_SECONDS:
+            connection.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        self._count_later("hits")
+        return True, pickle.loads(row[0])
+
+    def set(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now),
+            )
+            self._evict(connection)
+            self._flush_counts(connection)
+
+    def _evict(self, connection):
+        """Drops least recently used entries until the byte budget is met"""
+        total_bytes = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+        evicted_keys = []
+        for key, size in connection.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            evicted_keys.append((key,))
+            total_bytes -= size
+            if total_bytes <= self.max_bytes:
+                break
+        connection.executemany("DELETE FROM entries WHERE key = ?", evicted_keys)
+        self._count(connection, "evictions", len(evicted_keys))
+
+    def stats(self):
+        """Counters of every worker, up to their last flush, and this worker's latest ones"""
+        connection = self._connection()
+        self._flush_counts(connection)
+        counters = dict.fromkeys(counter_names, 0)
+        counters.update(connection.execute("SELECT name, value FROM counters").fetchall())
+        entries, total_bytes = connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        counters.update({"entries": entries, "bytes": total_bytes, "max_bytes": self.max_bytes})
+        return counters
+
+
+def cache_key(namespace, actor_name, *args):
+    # a cleared input gives None
+    return ":".join([namespace, normalize_name(actor_name or ""), *map(str, args)])
+
+
+def cached(cache, namespace):
+    """Caches func(actor_name, db, *args) by normalized actor name"""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(actor_name, db, *args):
+            key = cache_key(namespace, actor_name, *args)
+            found, value = cache.get(key)
+            if not found:
+                value = func(actor_name, db, *args)
+                cache.set(key, value)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+def cached_batch(cache, namespace):
+    """Caches func(actor_names, db, *args) -> {actor_name: value} entry by entry,
+    only the cache misses are passed on to func"""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(actor_names, db, *args):
+            results, missing_names = {}, []
+            for actor_name in actor_names:
+                found, value = cache.get(cache_key(namespace, actor_name, *args))
+                if found:
+                    results[actor_name] = value
+                else:
+                    missing_names.append(actor_name)
+            if missing_names:
+                for actor_name, value in func(missing_names, db, *args).items():
+                    cache.set(cache_key(namespace, actor_name, *args), value)
+                    results[actor_name] = value
+            return {actor_name: results[actor_name] for actor_name in actor_names}
+
+        return wrapper
+
+    return decorator
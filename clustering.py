@@ -0,0 +1,260 @@
+import os
+import random
+from collections import Counter, defaultdict
+
+import dotenv
+from dash import Patch
+
+dotenv.load_dotenv(override=True)
+
+# past this many elements, the client receives communities instead of the whole graph
+LOD_MAX_ELEMENTS = int(os.getenv("LOD_MAX_ELEMENTS", "2000"))
+# smaller communities are gathered in a single aggregate node
+MAX_COMMUNITIES = 200
+# caps communities so that an expanded one fits in the element budget with its edges,
+# plain label propagation also tends to merge power-law graphs into a single community
+MAX_COMMUNITY_SIZE = max(LOD_MAX_ELEMENTS // 8, 1)
+# smaller communities join a neighboring one, e.g. the co-stars left out of a full community
+MIN_COMMUNITY_SIZE = max(MAX_COMMUNITY_SIZE // 10, 2)
+MAX_ITERATIONS = 20
+COMMUNITY_PREFIX = "community:"
+OTHERS = "others"
+
+
+def label_propagation(adjacency, max_size, max_iterations=MAX_ITERATIONS, seed=0):
+    """node id -> community label. Every node repeatedly takes the most common label
+    among its neighbors, until no label changes. Labels are node ids, and a label
+    stops spreading once max_size nodes carry it."""
+    labels = {node_id: node_id for node_id in adjacency}
+    sizes = Counter(labels.values())
+    order = sorted(adjacency)
+    rng = random.Random(seed)
+    for _ in range(max_iterations):
+        rng.shuffle(order)
+        changed = False
+        for node_id in order:
+            label = labels[node_id]
+            counts = Counter(
+                labels[neighbor_id]
+                for neighbor_id in adjacency[node_id]
+                if labels[neighbor_id] == label or sizes[labels[neighbor_id]] < max_size
+            )
+            if not counts:
+                continue
+            best_count = max(counts.values())
+            candidates = [candidate for candidate, count in counts.items() if count == best_count]
+            if label not in candidates:
+                labels[node_id] = min(candidates)
+                sizes[label] -= 1
+                sizes[labels[node_id]] += 1
+                changed = True
+        if not changed:
+            break
+    return labels
+
+
+def merge_small_groups(groups, adjacency, min_size, max_size):
+    """Merges each group smaller than min_size into the neighboring group with the most
+    edges to it, among those with room left. Groups without room around them are packed
+    together with the other ones next to the same group, or with the isolated ones."""
+    label_of = {node_id: label for label, members in groups.items() for node_id in members}
+    satellites = defaultdict(list)
+    for label in sorted(groups, key=lambda label: (len(groups[label]), label)):
+        members = groups[label]
+        if len(members) >= min_size:
+            continue
+        counts = Counter(
+            label_of[neighbor_id]
+            for node_id in members
+            for neighbor_id in adjacency[node_id]
+            if label_of[neighbor_id] != label
+        )
+        ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+        fitting = [other for other, _ in ranked if len(groups[other]) + len(members) <= max_size]
+        if not fitting:
+            satellites[ranked[0][0] if ranked else None].append(label)
+            continue
+        groups[fitting[0]] += members
+        for node_id in members:
+            label_of[node_id] = fitting[0]
+        del groups[label]
+
+    for labels in satellites.values():
+        bin_label = None
+        for label in labels:
+            if label not in groups:
+                # another small group merged into it
+                continue
+            if bin_label is not None and len(groups[bin_label]) + len(groups[label]) <= max_size:
+                groups[bin_label] += groups.pop(label)
+            else:
+                bin_label = label
+    return groups
+
+
+def detect_communities(graph):
+    """community key -> member node ids, from the largest community to the smallest.
+    Communities are keyed by their best connected actor, so that keys survive small
+    changes of the graph."""
+    groups = defaultdict(list)
+    for node_id, label in label_propagation(graph.adjacency, MAX_COMMUNITY_SIZE).items():
+        groups[label].append(node_id)
+    groups = merge_small_groups(groups, graph.adjacency, MIN_COMMUNITY_SIZE, MAX_COMMUNITY_SIZE)
+    ranked = sorted(groups.values(), key=lambda members: (-len(members), min(members)))
+
+    communities = {}
+    for members in ranked[:MAX_COMMUNITIES]:
+        key = max(members, key=lambda node_id: (graph.degree(node_id), node_id))
+        communities[key] = sorted(members)
+    others = sorted(node_id for members in ranked[MAX_COMMUNITIES:] for node_id in members)
+    if others:
+        communities[OTHERS] = others
+    return communities
+
+
+def get_communities(graph):
+    """Communities of graph, only detected again after the graph changed"""
+    if graph.communities is None:
+        graph.communities = detect_communities(graph)
+    return graph.communities
+
+
+def community_id(key):
+    return f"{COMMUNITY_PREFIX}{key}"
+
+
+def is_community(element_id):
+    return element_id.startswith(COMMUNITY_PREFIX)
+
+
+def member_ids(element_ids, graph):
+    """Node ids with the community ids replaced by the ids of their members"""
+    if not any(is_community(element_id) for element_id in element_ids):
+        # plain actors, no need to detect communities
+        return list(element_ids)
+    communities = get_communities(graph)
+    node_ids = []
+    for element_id in element_ids:
+        if is_community(element_id):
+            node_ids += communities.get(element_id[len(COMMUNITY_PREFIX) :], [])
+        else:
+            node_ids.append(element_id)
+    return node_ids
+
+
+def community_element(key, members, graph):
+    label = "Other actors" if key == OTHERS else f"{key} (+{len(members) - 1})"
+    element = {
+        "data": {
+            "id": community_id(key),
+            "label": label,
+            "community": key,
+            "members": len(members),
+            "filtered": any(node_id in graph.filtered for node_id in members),
+        }
+    }
+    positions = [graph.get(node_id).get("position") for node_id in members]
+    positions = [position for position in positions if position is not None]
+    if positions:
+        element["position"] = {
+            axis: sum(position[axis] for position in positions) / len(positions)
+            for axis in ["x", "y"]
+        }
+    return element
+
+
+def level_of_detail(graph, max_elements=LOD_MAX_ELEMENTS):
+    """Bounded list of elements for the client. Each community is one aggregate node,
+    except for the expanded ones whose actors and inner edges are shown as is.
+    Edges between aggregates carry the number of relations they stand for, the heaviest
+    are kept within the element budget."""
+    communities = get_communities(graph)
+    # expanded communities, in click order, as long as they fit
+    budget = max_elements - len(communities)
+    expanded = []
+    for key in graph.expanded_communities:
+        members = communities.get(key)
+        if members is None:
+            continue
+        inner_edges = sum(len(graph.adjacency[node_id]) for node_id in members) // 2
+        cost = len(members) - 1 + inner_edges
+        if cost <= budget:
+            expanded.append(key)
+            budget -= cost
+    graph.expanded_communities = expanded
+
+    # what each node is shown as: itself or its community
+    shown_as = {}
+    for key, members in communities.items():
+        for node_id in members:
+            shown_as[node_id] = node_id if key in expanded else community_id(key)
+
+    elements = []
+    for key, members in communities.items():
+        if key in expanded:
+            elements += [graph.get(node_id) for node_id in members]
+        else:
+            elements.append(community_element(key, members, graph))
+
+    real_edges, weights = [], Counter()
+    for node_id, neighbors in graph.adjacency.items():
+        for neighbor_id, edge_id in neighbors.items():
+            if node_id > neighbor_id:
+                continue
+            pair = tuple(sorted((shown_as[node_id], shown_as[neighbor_id])))
+            if pair[0] == node_id and pair[1] == neighbor_id:
+                real_edges.append(graph.get(edge_id))
+            elif pair[0] != pair[1]:
+                weights[pair] += 1
+    budget = max_elements - len(elements)
+    elements += real_edges[:budget]
+    budget -= len(real_edges[:budget])
+    for (source, target), weight in weights.most_common(max(budget, 0)):
+        elements.append(
+            {
+                "data": {
+                    "id": f"{source} , {target}",
+                    "source": source,
+                    "target": target,
+                    "weight": weight,
+                    "filtered": False,
+                }
+            }
+        )
+    return elements
+
+
+def view_state(elements):
+    """Data and position of each element as sent, level_of_detail shares the actual
+    elements of expanded communities, which later change in place"""
+    return [
+        (dict(element["data"]), dict(element["position"]) if "position" in element else None)
+        for element in elements
+    ]
+
+
+def level_of_detail_patch(graph, elements):
+    """Patch turning the level of detail the client holds into elements, when both show
+    the same elements in the same order, as after a filter keystroke. Otherwise elements,
+    which replace the client elements as a whole."""
+    previous, graph.lod_view = graph.lod_view, view_state(elements)
+    if previous is None or [data["id"] for data, _ in previous] != [
+        data["id"] for data, _ in graph.lod_view
+    ]:
+        return elements
+    patch = Patch()
+    for slot, ((old_data, old_position), (data, position)) in enumerate(
+        zip(previous, graph.lod_view)
+    ):
+        if old_data.keys() != data.keys():
+            patch[slot]["data"] = data
+        else:
+            for key, value in data.items():
+                if old_data[key] != value:
+                    patch[slot]["data"][key] = value
+        if position != old_position:
+            if position is None:
+                del patch[slot]["position"]
+            else:
+                patch[slot]["position"] = position
+    return patch
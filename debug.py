@@ -1,5 +1,9 @@
+import dash_bootstrap_components as dbc
 from dash import dcc, html
 
+# elements listed per page of the debug inspector
+DEBUG_PAGE_SIZE = 50
+
 
 def mySwitch(id, value=True):
     return dcc.RadioItems(
@@ -402,6 +406,13 @@ layout_filters = {
             "parameters": {"value": False},
         },  # Uses random initial node positions on True
     },
+    # positions computed server-side by layout.py
+    "preset": {
+        # Ideal edge length, nodes closer than twice this length repel each other
+        "idealEdgeLength": {"type": mySlider, "parameters": {"value": 50, "min": 10}},
+        # Number of iterations of the force-directed solver
+        "numIter": {"type": mySlider, "parameters": {"value": 200, "min": 10}},
+    },
 }
 
 built_layouts = {
@@ -426,7 +437,8 @@ built_layouts = {
 def tabs(prod_panels, debug):
     if debug:
         return dcc.Tabs(
-            [
+            id="tabs",
+            children=[
                 dcc.Tab(
                     html.Div(prod_panels),
                     label="Main",
@@ -435,9 +447,32 @@ def tabs(prod_panels, debug):
                 dcc.Tab(
                     html.Div(
                         [
-                            myPre("debug-info", "Full graph"),
-                            myPre("debug-info-node", "Node info"),
-                            myPre("debug-info-edge", "Edge info"),
+                            # filled only while this tab is visible, see update_debug_inspector
+                            html.Div(
+                                [
+                                    html.Button(
+                                        "Refresh",
+                                        id="debug-refresh",
+                                        className="btn btn-outline-secondary btn-sm me-2",
+                                    ),
+                                    html.Div(id="debug-summary", className="small"),
+                                ],
+                                className="d-flex align-items-center my-1",
+                            ),
+                            dbc.Pagination(
+                                id="debug-page",
+                                max_value=1,
+                                active_page=1,
+                                fully_expanded=False,
+                                size="sm",
+                                className="my-1",
+                            ),
+                            html.Div(
+                                id="debug-elements",
+                                style={"height": "calc(50% - 8px)"},
+                                className="overflow-auto",
+                            ),
+                            myPre("debug-info-element", "Element"),
                         ],
                         style={"height": "500px"},
                     ),
@@ -483,6 +518,7 @@ def tabs(prod_panels, debug):
                                                     "cola",
                                                     "euler",
                                                     "spread",
+                                                    "preset",
                                                 ],
                                                 value="fcose",
                                                 clearable=False,
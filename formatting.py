@@ -1,4 +1,5 @@
 import math
+import unicodedata
 
 
 def deathYear_parser(deathYear: float):
@@ -39,8 +40,27 @@ def movie_string(movie_info: dict):
     return movie_str
 
 
-def edge_string(common_movies: list):
-    s = "s" if len(common_movies) > 1 else ""
-    edge_str = f"{len(common_movies)} common movie{s}:\n"  # add unordered list html element instead
-    edge_str += "\n".join([movie_string(movie_info) for movie_info in common_movies])
+def movie_sort_key(movie_info: dict):
+    # by release year then title, missing years first
+    release_year = movie_info["releaseYear"]
+    if release_year is None or math.isnan(release_year):
+        release_year = -math.inf
+    return release_year, movie_info["primaryTitle"]
+
+
+def edge_string(movie_ids: list, movies: dict):
+    """movies is the session movie table, movie id -> movie info"""
+    s = "s" if len(movie_ids) > 1 else ""
+    edge_str = f"{len(movie_ids)} common movie{s}:\n"  # add unordered list html element instead
+    movie_infos = sorted(
+        (movies[movie_id] for movie_id in movie_ids if movies.get(movie_id)), key=movie_sort_key
+    )
+    edge_str += "\n".join([movie_string(movie_info) for movie_info in movie_infos])
     return edge_str
+
+
+def normalize_name(name: str):
+    """Case, accent and whitespace insensitive form of a name, used as lookup key"""
+    decomposed = unicodedata.normalize("NFKD", name)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.casefold().split())
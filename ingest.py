@@ -0,0 +1,160 @@
+"""Load raw IMDb TSV dumps (https://datasets.imdbws.com/) into the MongoDB collections.
+
+    python ingest.py path/to/dumps [--chunk-size 10000]
+
+Files are streamed in fixed-size chunks so memory stays bounded whatever the dump size.
+"""
+
+import argparse
+import csv
+import gzip
+import math
+import os
+import time
+from itertools import islice
+
+from pymongo import ASCENDING, TEXT
+from pymongo.errors import BulkWriteError
+
+from db import connect_mongo
+
+ACTOR_CATEGORIES = {"actor", "actress"}
+MOVIE_TYPES = {"movie"}
+IMDB_NULL = "\\N"
+DUPLICATE_KEY_ERROR = 11000
+
+
+def read_tsv(path):
+    """Yields one dict per row of a gzipped IMDb TSV file"""
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as tsv_file:
+        reader = csv.reader(tsv_file, delimiter="\t", quoting=csv.QUOTE_NONE)
+        header = next(reader)
+        for row in reader:
+            yield {key: (None if value == IMDB_NULL else value) for key, value in zip(header, row)}
+
+
+def chunked(iterable, chunk_size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, chunk_size)):
+        yield chunk
+
+
+def parse_number(value):
+    # missing numbers are stored as NaN, as expected by formatting.py
+    return math.nan if value is None else int(value)
+
+
+def movie_doc(row):
+    if row["titleType"] not in MOVIE_TYPES:
+        return None
+    return {
+        "_id": row["tconst"],
+        "primaryTitle": row["primaryTitle"],
+        "originalTitle": row["originalTitle"],
+        "releaseYear": parse_number(row["startYear"]),
+        "runtimeMinutes": parse_number(row["runtimeMinutes"]),
+        "genres": row["genres"],
+    }
+
+
+def actor_doc(row):
+    professions = (row["primaryProfession"] or "").split(",")
+    acting_professions = [p for p in professions if p in ACTOR_CATEGORIES]
+    if not acting_professions:
+        return None
+    return {
+        "_id": row["nconst"],
+        "primaryName": row["primaryName"],
+        "birthYear": parse_number(row["birthYear"]),
+        "deathYear": parse_number(row["deathYear"]),
+        "primaryProfession": acting_professions[0],
+    }
+
+
+def principal_doc(row, movie_ids):
+    if row["category"] not in ACTOR_CATEGORIES or row["tconst"] not in movie_ids:
+        return None
+    return {
+        # same _id on every run, so that --keep-collections skips the rows already there
+        "_id": f"{row['tconst']}:{row['nconst']}:{row['ordering']}",
+        "movie_id": row["tconst"],
+        "actor_id": row["nconst"],
+        "category": row["category"],
+    }
+
+
+def insert_new(collection, docs):
+    """Inserts docs, skipping those whose _id is already in collection.
+    Returns the number of skipped docs, any other write error is raised."""
+    try:
+        collection.insert_many(docs, ordered=False)
+    except BulkWriteError as error:
+        write_errors = error.details["writeErrors"]
+        if any(write_error["code"] != DUPLICATE_KEY_ERROR for write_error in write_errors):
+            raise
+        return len(write_errors)
+    return 0
+
+
+def ingest(rows, to_doc, collection, chunk_size):
+    """Converts rows with to_doc (None to skip) and bulk inserts them chunk by chunk"""
+    start = time.perf_counter()
+    nb_rows, nb_docs, nb_skipped = 0, 0, 0
+    for chunk in chunked(rows, chunk_size):
+        nb_rows += len(chunk)
+        docs = [doc for doc in map(to_doc, chunk) if doc is not None]
+        if docs:
+            skipped = insert_new(collection, docs)
+            nb_docs += len(docs) - skipped
+            nb_skipped += skipped
+    elapsed = time.perf_counter() - start
+    print(
+        f"{collection.name}: {nb_docs}/{nb_rows} rows inserted, {nb_skipped} already there, "
+        f"in {elapsed:.1f}s ({nb_rows / max(elapsed, 1e-9):,.0f} rows/s)"
+    )
+    return nb_docs
+
+
+def ingest_imdb(db, data_dir, chunk_size=10_000, drop=True):
+    if drop:
+        for name in ["title_basics", "name_basics", "title_principal"]:
+            db[name].drop()
+
+    # only the movie ids are kept in memory, to filter principals
+    movie_ids = set()
+
+    def movie_doc_and_record(row):
+        doc = movie_doc(row)
+        if doc is not None:
+            movie_ids.add(doc["_id"])
+        return doc
+
+    def tsv_path(name):
+        return os.path.join(data_dir, f"{name}.tsv.gz")
+
+    ingest(read_tsv(tsv_path("title.basics")), movie_doc_and_record, db["title_basics"], chunk_size)
+    ingest(read_tsv(tsv_path("name.basics")), actor_doc, db["name_basics"], chunk_size)
+    ingest(
+        read_tsv(tsv_path("title.principals")),
+        lambda row: principal_doc(row, movie_ids),
+        db["title_principal"],
+        chunk_size,
+    )
+
+    # indexes the query pipelines rely on
+    db["name_basics"].create_index([("primaryName", TEXT)])
+    db["title_principal"].create_index([("actor_id", ASCENDING)])
+    db["title_principal"].create_index([("movie_id", ASCENDING)])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("data_dir", help="directory holding the *.tsv.gz IMDb dumps")
+    parser.add_argument("--chunk-size", type=int, default=10_000)
+    parser.add_argument(
+        "--keep-collections",
+        action="store_true",
+        help="append instead of dropping first, documents already there are skipped",
+    )
+    args = parser.parse_args()
+    ingest_imdb(connect_mongo(), args.data_dir, args.chunk_size, drop=not args.keep_collections)
@@ -0,0 +1,235 @@
+import numpy as np
+
+# name of the cytoscape layout reading the positions computed here
+SERVER_LAYOUT = "preset"
+EDGE_LENGTH = 50
+ITERATIONS = 200
+MIN_EDGE_LENGTH = 1.0
+# pull towards the center, keeps disconnected components together
+GRAVITY = 0.05
+# incremental placement, see place_new_nodes
+LOCAL_ITERATIONS = 50
+SEED_SPACING = 0.6
+GOLDEN_ANGLE = np.pi * (3 - np.sqrt(5))
+
+
+def layout_options(layout):
+    """Options of the server-side layout from the cytoscape layout, None when the client lays out"""
+    if layout is None or layout.get("name") != SERVER_LAYOUT:
+        return None
+    # a zero edge length divides positions by zero
+    return {
+        "edge_length": max(float(layout.get("idealEdgeLength", EDGE_LENGTH)), MIN_EDGE_LENGTH),
+        "iterations": max(int(layout.get("numIter", ITERATIONS)), 1),
+    }
+
+
+def close_pairs(positions, sources, radius):
+    """(i, j) index arrays of the points j closer than radius to a point i of sources.
+    Points are bucketed in a grid of radius-sized cells, so only the 9 cells
+    around each source are looked at."""
+    cells = np.floor(positions / radius).astype(np.int64)
+    # shift so that neighboring cells have non-negative coordinates, then flatten
+    cells -= cells.min(axis=0) - 1
+    stride = cells[:, 1].max() + 2
+    keys = cells[:, 0] * stride + cells[:, 1]
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    source_keys = keys[sources]
+    i_parts, j_parts = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            neighbor_keys = source_keys + dx * stride + dy
+            starts = np.searchsorted(sorted_keys, neighbor_keys, side="left")
+            counts = np.searchsorted(sorted_keys, neighbor_keys, side="right") - starts
+            # every point of the neighbor cell, for every source
+            first = np.repeat(np.cumsum(counts) - counts, counts)
+            within = np.arange(counts.sum()) - first
+            i_parts.append(np.repeat(sources, counts))
+            j_parts.append(order[np.repeat(starts, counts) + within])
+    i, j = np.concatenate(i_parts), np.concatenate(j_parts)
+    keep = i != j
+    i, j = i[keep], j[keep]
+    keep = np.sum((positions[i] - positions[j]) ** 2, axis=1) < radius**2
+    return i[keep], j[keep]
+
+
+def force_layout(
+    positions,
+    pinned,
+    edges,
+    edge_length=EDGE_LENGTH,
+    iterations=ITERATIONS,
+    gravity=GRAVITY,
+    temperature=None,
+):
+    """Fruchterman-Reingold layout with grid-based repulsion.
+
+    positions is a (n, 2) array, the rows flagged in pinned are kept as is and only
+    repel the others. edges is a (m, 2) array of position indices.
+    Moves are capped by a temperature decreasing linearly to 0."""
+    positions = np.array(positions, dtype=np.float64)
+    free = np.flatnonzero(~np.asarray(pinned, dtype=bool))
+    if len(free) == 0 or iterations <= 0:
+        return positions
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    nb_points = len(positions)
+    k2 = edge_length**2
+    if temperature is None:
+        temperature = edge_length * np.sqrt(len(free))
+    cooling = temperature / iterations
+    center = positions.mean(axis=0)
+
+    for _ in range(iterations):
+        displacement = np.zeros_like(positions)
+
+        # repulsion k^2 / d between points closer than 2k
+        i, j = close_pairs(positions, free, 2 * edge_length)
+        delta = positions[i] - positions[j]
+        # caps the force between (nearly) overlapping points
+        distance2 = np.maximum(np.sum(delta**2, axis=1), 0.01 * k2)
+        force = delta * (k2 / distance2)[:, None]
+        for axis in range(2):
+            displacement[:, axis] += np.bincount(i, force[:, axis], minlength=nb_points)
+
+        # attraction d^2 / k along edges
+        delta = positions[edges[:, 0]] - positions[edges[:, 1]]
+        force = delta * (np.sqrt(np.sum(delta**2, axis=1)) / edge_length)[:, None]
+        for axis in range(2):
+            displacement[:, axis] -= np.bincount(edges[:, 0], force[:, axis], minlength=nb_points)
+            displacement[:, axis] += np.bincount(edges[:, 1], force[:, axis], minlength=nb_points)
+
+        displacement -= gravity * (positions - center)
+
+        moves = displacement[free]
+        lengths = np.maximum(np.sqrt(np.sum(moves**2, axis=1)), 1e-9)
+        positions[free] += moves * (np.minimum(lengths, temperature) / lengths)[:, None]
+        temperature -= cooling
+    return positions
+
+
+def sunflower(center, nb_points, spacing):
+    """nb_points spread evenly on a disk around center, leaving center itself free"""
+    ranks = np.arange(1, nb_points + 1)
+    radii = spacing * np.sqrt(ranks)
+    angles = ranks * GOLDEN_ANGLE
+    return center + radii[:, None] * np.column_stack([np.cos(angles), np.sin(angles)])
+
+
+def node_position(graph, node_id):
+    position = graph.get(node_id)["position"]
+    return np.array([position["x"], position["y"]])
+
+
+def seed_positions(graph, edge_length):
+    """Initial positions of the unplaced nodes, around a placed neighbor (their anchor)
+    or around a neighbor seeded before them. Nodes cut from the placed ones are seeded
+    to the right of the graph."""
+    seeds = {}
+    pending = set(graph.unplaced)
+    while pending:
+        by_anchor = {}
+        for node_id in pending:
+            anchors = [
+                neighbor_id
+                for neighbor_id in graph.adjacency[node_id]
+                if neighbor_id not in graph.unplaced or neighbor_id in seeds
+            ]
+            if anchors:
+                # around the best connected neighbor, usually the expanded actor
+                anchor = max(anchors, key=lambda anchor_id: (graph.degree(anchor_id), anchor_id))
+                by_anchor.setdefault(anchor, []).append(node_id)
+        if not by_anchor:
+            break
+        for anchor, node_ids in by_anchor.items():
+            center = seeds[anchor] if anchor in seeds else node_position(graph, anchor)
+            for node_id, seed in zip(
+                sorted(node_ids), sunflower(center, len(node_ids), SEED_SPACING * edge_length)
+            ):
+                seeds[node_id] = seed
+            pending.difference_update(node_ids)
+
+    if pending:
+        placed = list(seeds.values())
+        bounds = graph.position_grid.bounds()
+        if bounds is not None:
+            # to the nearest grid cell
+            placed += bounds
+        low, high = np.min(placed, axis=0), np.max(placed, axis=0)
+        center = np.array([high[0] + 2 * edge_length, (low[1] + high[1]) / 2])
+        for node_id, seed in zip(
+            sorted(pending), sunflower(center, len(pending), SEED_SPACING * edge_length)
+        ):
+            seeds[node_id] = seed
+    return seeds
+
+
+def place_new_nodes(graph, edge_length=EDGE_LENGTH, iterations=LOCAL_ITERATIONS):
+    """Seeds the unplaced nodes around their anchors, then relaxes them with every other node
+    pinned. Only the new nodes, their placed neighbors and the placed nodes around the seeds
+    take part in the relaxation, so its cost follows the number of new nodes rather than
+    the graph size."""
+    seeds = seed_positions(graph, edge_length)
+    new_ids = list(seeds)
+
+    # pinned nodes close enough to the seeds to repel them, and the neighbors pulling them
+    pinned_ids = {neighbor_id for node_id in new_ids for neighbor_id in graph.adjacency[node_id]}
+    for x, y in seeds.values():
+        pinned_ids |= graph.position_grid.around(x, y, 2 * edge_length)
+    pinned_ids = sorted(pinned_ids - graph.unplaced)
+
+    node_ids = new_ids + pinned_ids
+    node_index = {node_id: i for i, node_id in enumerate(node_ids)}
+    positions = np.array(
+        [seeds[node_id] for node_id in new_ids]
+        + [node_position(graph, node_id) for node_id in pinned_ids]
+    ).reshape(-1, 2)
+    pinned = np.arange(len(node_ids)) >= len(new_ids)
+    edges = {
+        tuple(sorted((node_index[node_id], node_index[neighbor_id])))
+        for node_id in new_ids
+        for neighbor_id in graph.adjacency[node_id]
+    }
+    # short relaxation, seeds are already close to their final positions
+    positions = force_layout(
+        positions,
+        pinned,
+        sorted(edges),
+        edge_length,
+        iterations,
+        gravity=0,
+        temperature=edge_length,
+    )
+    for node_id in new_ids:
+        graph.set_position(node_id, *positions[node_index[node_id]])
+
+
+def layout_graph(graph, edge_length=EDGE_LENGTH, iterations=ITERATIONS):
+    """Places the nodes of graph without position, the placed ones stay where they are.
+    The first nodes get a full layout, later ones are placed incrementally."""
+    if not graph.unplaced:
+        return
+    if len(graph.unplaced) < len(graph.adjacency):
+        place_new_nodes(graph, edge_length, max(1, iterations // 4))
+        return
+
+    node_ids = list(graph.adjacency)
+    node_index = {node_id: i for i, node_id in enumerate(node_ids)}
+    # nodes start at random in a disk sized for the whole graph
+    rng = np.random.default_rng()
+    radius = edge_length * np.sqrt(len(node_ids))
+    angles = rng.uniform(0, 2 * np.pi, len(node_ids))
+    distances = radius * np.sqrt(rng.uniform(0, 1, len(node_ids)))
+    positions = distances[:, None] * np.column_stack([np.cos(angles), np.sin(angles)])
+
+    edges = [
+        (node_index[source], node_index[target])
+        for source, neighbors in graph.adjacency.items()
+        for target in neighbors
+        if source < target
+    ]
+    pinned = np.zeros(len(node_ids), dtype=bool)
+    positions = force_layout(positions, pinned, edges, edge_length, iterations)
+    for node_id, position in zip(node_ids, positions):
+        graph.set_position(node_id, *position)
@@ -0,0 +1,345 @@
+"""Replay Dash callback traffic against gunicorn to find how many explorers a node supports.
+
+    python loadtest.py [--users 8] [--duration 60] [--workers 1] [--url http://host:port]
+
+Unless --url is given, gunicorn is started locally as in the Procfile, on the local backend
+over a synthetic graph (see bench.py) standing in for MongoDB. Each virtual user replays
+the _dash-update-component requests of an exploration: add an actor, select it, expand it,
+select an edge, type a filter, then remove the actor. Reports throughput, latency
+percentiles per callback and how often every worker was busy.
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import numpy as np
+import requests
+
+from bench import SYNTHETIC_ACTORS, synthetic_graph
+from local_graph import LocalGraph
+
+USERS = 8
+DURATION_SECONDS = 60
+# the Procfile runs gunicorn with its default of one sync worker
+WORKERS = 1
+PORT = 8050
+STARTUP_SECONDS = 60
+# in-flight requests are sampled this often to measure worker saturation
+SAMPLING_SECONDS = 0.01
+FILTER_KEYSTROKES = 5
+
+
+def parse_outputs(output):
+    """{"id", "property"} of each output, from the output key of a dependency"""
+    if not output.startswith(".."):
+        component_id, component_property = output.rsplit(".", 1)
+        return {"id": component_id, "property": component_property}
+    return [
+        dict(zip(["id", "property"], single_output.rsplit(".", 1)))
+        for single_output in output[2:-2].split("...")
+    ]
+
+
+class DashClient:
+    """What the Dash renderer sends for a callback, for one browser session"""
+
+    def __init__(self, url, dependencies):
+        self.url = url
+        self.dependencies = dependencies
+        self.http = requests.Session()
+        self.session_id = str(uuid.uuid4())
+        # graph version of the elements received, sent back as the renderer does
+        self.graph_version = 0
+
+    def find(self, input_id, input_property, output_prefix):
+        for dependency in self.dependencies:
+            if dependency["output"].lstrip(".").startswith(output_prefix) and any(
+                dependency_input == {"id": input_id, "property": input_property}
+                for dependency_input in dependency["inputs"]
+            ):
+                return dependency
+        raise KeyError(f"no callback from {input_id}.{input_property} to {output_prefix}")
+
+    def body(self, dependency, values, changed):
+        values = dict(
+            values, **{"session_id.data": self.session_id, "graph_version.data": self.graph_version}
+        )
+
+        def with_values(references):
+            return [
+                dict(reference, value=values.get(f"{reference['id']}.{reference['property']}"))
+                for reference in references
+            ]
+
+        return {
+            "output": dependency["output"],
+            "outputs": parse_outputs(dependency["output"]),
+            "inputs": with_values(dependency["inputs"]),
+            "state": with_values(dependency["state"]),
+            "changedPropIds": [changed],
+        }
+
+    def call(self, dependency, values, changed):
+        """Returns the response JSON, None when the callback did not update anything"""
+        response = self.http.post(
+            f"{self.url}/_dash-update-component", json=self.body(dependency, values, changed)
+        )
+        if response.status_code == 204:
+            return None
+        response.raise_for_status()
+        output = response.json()
+        self.graph_version = (
+            output["response"].get("graph_version", {}).get("data", self.graph_version)
+        )
+        return output
+
+
+def sent_elements(response):
+    """Elements sent to cyto_graph, whether as a Patch, the whole graph or its level of detail"""
+    if not response:
+        return []
+    elements = response["response"].get("cyto_graph", {}).get("elements")
+    if isinstance(elements, dict):
+        return [
+            element
+            for operation in elements["operations"]
+            if operation["operation"] == "Extend"
+            for element in operation["params"]["value"]
+        ]
+    return elements or []
+
+
+class Recorder:
+    """Latencies per callback, and the number of requests in flight"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def timed(self, name, call, *args):
+        with self.lock:
+            self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            return call(*args)
+        except (requests.RequestException, ValueError):
+            with self.lock:
+                self.errors[name] += 1
+            return None
+        finally:
+            latency = time.perf_counter() - start
+            with self.lock:
+                self.in_flight -= 1
+                self.latencies[name].append(latency)
+
+
+def explore(client, recorder, actor_name, think_seconds):
+    """One exploration, the requests a user triggers by clicking around"""
+
+    def step(name, input_id, input_property, output_prefix, values):
+        dependency = client.find(input_id, input_property, output_prefix)
+        changed = f"{input_id}.{input_property}"
+        response = recorder.timed(name, client.call, dependency, values, changed)
+        time.sleep(think_seconds)
+        return response
+
+    response = step(
+        "add_actor",
+        "actor_add_button",
+        "n_clicks",
+        "cyto_graph.elements",
+        {"actor_add_button.n_clicks": 1, "actor_add.value": actor_name},
+    )
+    elements = sent_elements(response)
+    nodes = [element["data"] for element in elements if "source" not in element["data"]]
+    edges = [element["data"] for element in elements if "source" in element["data"]]
+    selected = [data for data in nodes if data["id"] == actor_name][:1] or nodes[:1]
+    if selected:
+        step(
+            "displayNodeData",
+            "cyto_graph",
+            "selectedNodeData",
+            "node_info",
+            {"cyto_graph.selectedNodeData": selected},
+        )
+        step(
+            "expand_selected_actors",
+            "btn-expand-seleted-nodes",
+            "n_clicks",
+            "cyto_graph.elements",
+            {"btn-expand-seleted-nodes.n_clicks": 1, "cyto_graph.selectedNodeData": selected},
+        )
+    if edges:
+        step(
+            "displayEdgeData",
+            "cyto_graph",
+            "selectedEdgeData",
+            "edge_info",
+            {"cyto_graph.selectedEdgeData": edges[:1]},
+        )
+    # every keystroke triggers both the filter and the typeahead suggestions
+    for query in [actor_name[:length] for length in range(1, FILTER_KEYSTROKES + 1)] + [""]:
+        values = {"actor_filter.value": query}
+        step("generate_filtered_stylesheet", "actor_filter", "value", "cyto_graph", values)
+        step("update_suggestions", "actor_filter", "value", "actor_filter_suggestions", values)
+    if selected:
+        step(
+            "rm_selected_nodes",
+            "btn-rm-selected-nodes",
+            "n_clicks",
+            "cyto_graph.elements",
+            {"btn-rm-selected-nodes.n_clicks": 1, "cyto_graph.selectedNodeData": selected},
+        )
+
+
+def user(url, dependencies, recorder, actor_names, deadline, think_seconds, seed):
+    rng = random.Random(seed)
+    while time.perf_counter() < deadline:
+        # a new browser session for each exploration, as on page reload
+        client = DashClient(url, dependencies)
+        explore(client, recorder, rng.choice(actor_names), think_seconds)
+
+
+def cpu_seconds(pid):
+    """User and system CPU time of a process, from /proc"""
+    with open(f"/proc/{pid}/stat") as stat_file:
+        fields = stat_file.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def worker_pids(master_pid):
+    """Children of the gunicorn master, none where /proc is missing"""
+    if not os.path.isdir("/proc"):
+        return []
+    pids = []
+    for entry in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{entry}/stat") as stat_file:
+                fields = stat_file.read().rsplit(")", 1)[1].split()
+        except FileNotFoundError:
+            continue
+        if int(fields[1]) == master_pid:
+            pids.append(int(entry))
+    return pids
+
+
+def start_server(graph_path, work_dir, workers, port):
+    env = dict(
+        os.environ,
+        GRAPH_BACKEND="local",
+        LOCAL_GRAPH_PATH=graph_path,
+        SESSION_PATH=os.path.join(work_dir, "sessions.sqlite3"),
+        CACHE_PATH=os.path.join(work_dir, "cache.sqlite3"),
+        MOVIES_CACHE_PATH=os.path.join(work_dir, "movies_cache.sqlite3"),
+        SNAPSHOT_PATH=os.path.join(work_dir, "snapshots.sqlite3"),
+    )
+    server = subprocess.Popen(
+        ["gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(workers), "app:server"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.perf_counter() + STARTUP_SECONDS
+    while time.perf_counter() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("gunicorn exited before serving")
+        try:
+            requests.get(f"{url}/_dash-layout", timeout=1).raise_for_status()
+            return server, url
+        except requests.RequestException:
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError(f"gunicorn did not answer within {STARTUP_SECONDS} s")
+
+
+def report(recorder, elapsed, busy_share, max_in_flight, workers, worker_cpu):
+    total = sum(len(latencies) for latencies in recorder.latencies.values())
+    print(f"\n{total} requests in {elapsed:.1f} s, {total / elapsed:.1f} requests/s")
+    print(f"{'callback':<30}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, latencies in sorted(recorder.latencies.items()):
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        print(
+            f"{name:<30}{len(latencies):>8}{recorder.errors[name]:>8}"
+            f"{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}"
+        )
+    if workers is not None:
+        print(
+            f"\nall {workers} workers busy {busy_share:.0%} of the time, "
+            f"up to {max_in_flight} requests in flight"
+        )
+    for pid, seconds in worker_cpu.items():
+        print(f"worker {pid}: {seconds / elapsed:.0%} CPU")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=USERS, help="concurrent explorers")
+    parser.add_argument("--duration", type=float, default=DURATION_SECONDS)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="gunicorn sync workers")
+    parser.add_argument("--think", type=float, default=0, help="seconds between two requests")
+    parser.add_argument("--url", help="target a running server instead of starting one")
+    parser.add_argument("--local-graph", help="local graph to serve instead of a synthetic one")
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="loadtest_")
+    graph_path = args.local_graph
+    if graph_path is None:
+        graph_path = os.path.join(work_dir, "local_graph")
+        synthetic_graph(graph_path, SYNTHETIC_ACTORS)
+    graph = LocalGraph(graph_path)
+    # actors with at least one co-star, the others make trivial explorations
+    actor_names = graph.actors["primaryName"].take(np.diff(graph.offsets) > 0)
+
+    server = None
+    url, workers = args.url, None
+    if url is None:
+        server, url = start_server(graph_path, work_dir, args.workers, args.port)
+        workers = args.workers
+    try:
+        dependencies = requests.get(f"{url}/_dash-dependencies").json()
+        pids = worker_pids(server.pid) if server is not None else []
+        cpu_start = {pid: cpu_seconds(pid) for pid in pids}
+
+        recorder = Recorder()
+        start = time.perf_counter()
+        deadline = start + args.duration
+        threads = [
+            threading.Thread(
+                target=user,
+                args=(url, dependencies, recorder, actor_names, deadline, args.think, seed),
+            )
+            for seed in range(args.users)
+        ]
+        for thread in threads:
+            thread.start()
+        # share of the time every worker had a request, the next ones queue up
+        busy_samples, nb_samples, max_in_flight = 0, 0, 0
+        while any(thread.is_alive() for thread in threads):
+            in_flight = recorder.in_flight
+            max_in_flight = max(max_in_flight, in_flight)
+            busy_samples += workers is not None and in_flight >= workers
+            nb_samples += 1
+            time.sleep(SAMPLING_SECONDS)
+        elapsed = time.perf_counter() - start
+        worker_cpu = {pid: cpu_seconds(pid) - cpu_start[pid] for pid in pids}
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    report(recorder, elapsed, busy_samples / max(nb_samples, 1), max_in_flight, workers, worker_cpu)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,442 @@
+import math
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from formatting import normalize_name
+
+actor_columns = ["_id", "primaryName", "birthYear", "deathYear", "primaryProfession"]
+movie_columns = ["_id", "primaryTitle", "originalTitle", "releaseYear", "runtimeMinutes", "genres"]
+numeric_columns = ["birthYear", "deathYear", "releaseYear", "runtimeMinutes"]
+csr_arrays = ["offsets", "neighbors", "edge_movie_offsets", "edge_movies"]
+# shortest paths longer than this many hops are not looked for
+MAX_PATH_LENGTH = 12
+
+
+def _load(path, name):
+    return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+
+def pack_strings(values):
+    """utf-8 bytes of every string back to back, and their offsets"""
+    encoded = [value.encode() for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+class StringColumn:
+    """Strings packed by pack_strings, string i is blob[offsets[i]:offsets[i + 1]].
+    Nothing is padded to the longest string as in a numpy str array.
+    utf-8 bytes sort like the strings, so sorted columns are binary searched on bytes."""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def load(cls, path, name):
+        return cls(_load(path, name), _load(path, f"{name}_offsets"))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def encoded(self, index):
+        return self.blob[self.offsets[index] : self.offsets[index + 1]].tobytes()
+
+    def __getitem__(self, index):
+        return self.encoded(index).decode()
+
+    def take(self, indices):
+        """Strings at an array of indices or where a boolean mask is set"""
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+        return [self[index] for index in indices.tolist()]
+
+    def tolist(self):
+        blob = self.blob.tobytes()
+        offsets = self.offsets.tolist()
+        return [blob[start:end].decode() for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def searchsorted(self, value, side="left"):
+        key = value.encode()
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            encoded = self.encoded(middle)
+            if encoded < key or (side == "right" and encoded == key):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+class LocalGraph:
+    """Co-star graph stored as memory-mapped compressed-sparse-row arrays.
+
+    Actors and movies are integer indices into column arrays sorted by IMDb id,
+    numeric columns are float32 arrays and text columns StringColumn.
+    The co-stars of actor i are neighbors[offsets[i]:offsets[i + 1]] and the common
+    movies of edge k are edge_movies[edge_movie_offsets[k]:edge_movie_offsets[k + 1]].
+    Pages are shared between processes mapping the same files."""
+
+    def __init__(self, path):
+        self.path = path
+        self.actors = _load_columns(path, "actor", actor_columns)
+        self.movies = _load_columns(path, "movie", movie_columns)
+        for name in csr_arrays:
+            setattr(self, name, _load(path, name))
+        self.sorted_names = StringColumn.load(path, "sorted_names")
+        self.name_order = _load(path, "name_order")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def find_actors(self, actor_name):
+        """Indices of the actors whose normalized name is exactly actor_name"""
+        key = normalize_name(actor_name)
+        start = self.sorted_names.searchsorted(key, side="left")
+        end = self.sorted_names.searchsorted(key, side="right")
+        return [int(actor_index) for actor_index in self.name_order[start:end]]
+
+    def find_actor_by_id(self, actor_id):
+        actor_index = self.actors["_id"].searchsorted(actor_id)
+        if actor_index == len(self) or self.actors["_id"][actor_index] != actor_id:
+            return None
+        return actor_index
+
+    def degree(self, actor_index):
+        return int(self.offsets[actor_index + 1] - self.offsets[actor_index])
+
+    def actor_doc(self, actor_index):
+        return {column: as_python(values[actor_index]) for column, values in self.actors.items()}
+
+    def movie_doc(self, movie_index):
+        return {column: as_python(values[movie_index]) for column, values in self.movies.items()}
+
+    def find_movie_by_id(self, movie_id):
+        movie_index = self.movies["_id"].searchsorted(movie_id)
+        if movie_index == len(self.movies["_id"]) or self.movies["_id"][movie_index] != movie_id:
+            return None
+        return movie_index
+
+    def relation_doc(self, actor_doc, edge):
+        """Same shape as a giga_query result for the edge-th entry of neighbors"""
+        companion_doc = self.actor_doc(self.neighbors[edge])
+        start, end = self.edge_movie_offsets[edge], self.edge_movie_offsets[edge + 1]
+        movie_ids = self.movies["_id"].take(self.edge_movies[start:end])
+        return {
+            "main_actor": as_relation_actor(actor_doc),
+            "companion_actor": as_relation_actor(companion_doc),
+            "movie_ids": movie_ids,
+            "count": len(movie_ids),
+        }
+
+    def edge_index(self, actor_index, neighbor_index):
+        """Position of neighbor_index among the co-stars of actor_index, they are sorted"""
+        start, end = self.offsets[actor_index], self.offsets[actor_index + 1]
+        return int(start + np.searchsorted(self.neighbors[start:end], neighbor_index))
+
+    def expand(self, actor_indices):
+        """(actor index, co-star index) pairs of every edge leaving actor_indices"""
+        starts = self.offsets[actor_indices]
+        counts = self.offsets[actor_indices + 1] - starts
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+        edges = np.repeat(starts, counts) + np.arange(counts.sum()) - first
+        return np.repeat(actor_indices, counts), self.neighbors[edges]
+
+    def shortest_path(self, sources, targets, max_length=MAX_PATH_LENGTH):
+        """Bidirectional BFS between two sets of actor indices, each step expands the
+        frontier with the fewest edges to scan. Returns the actor indices along a shortest
+        path (empty if there is none within max_length hops) and the search statistics.
+        Memory follows the visited actors, not the graph size."""
+        start_time = time.perf_counter()
+        frontiers = [np.unique(np.asarray(sources, dtype=np.int64))]
+        frontiers.append(np.unique(np.asarray(targets, dtype=np.int64)))
+        # sorted indices of the actors visited on each side
+        visited = list(frontiers)
+        # (actors, their parents) reached at each step on each side, -1 for the roots
+        levels = [[(frontier, np.full(len(frontier), -1))] for frontier in frontiers]
+        stats = {
+            "expansions": 0,
+            "edges_scanned": 0,
+            "frontier_sizes": [[len(frontier)] for frontier in frontiers],
+        }
+
+        meeting = np.intersect1d(frontiers[0], frontiers[1])
+        length = 0
+        while not len(meeting) and length < max_length and all(map(len, frontiers)):
+            costs = [np.sum(self.offsets[f + 1] - self.offsets[f]) for f in frontiers]
+            side = int(costs[1] < costs[0])
+            origins, reached = self.expand(frontiers[side])
+            stats["expansions"] += len(frontiers[side])
+            stats["edges_scanned"] += len(reached)
+
+            new = ~_contains(visited[side], reached)
+            reached, first = np.unique(reached[new], return_index=True)
+            levels[side].append((reached, origins[new][first]))
+            visited[side] = np.union1d(visited[side], reached)
+            frontiers[side] = reached
+            stats["frontier_sizes"][side].append(len(reached))
+            length += 1
+            # every meeting actor closes a path of the same, shortest, length
+            meeting = reached[_contains(visited[1 - side], reached)]
+
+        path = []
+        if len(meeting):
+            halves = [_path_to_root(side_levels, int(meeting[0])) for side_levels in levels]
+            path = halves[0][::-1] + halves[1][1:]
+        stats["length"] = len(path) - 1 if path else None
+        stats["seconds"] = time.perf_counter() - start_time
+        return path, stats
+
+    def actor_relations(self, actor_index):
+        actor_doc = self.actor_doc(actor_index)
+        start, end = self.offsets[actor_index], self.offsets[actor_index + 1]
+        return [self.relation_doc(actor_doc, edge) for edge in range(start, end)]
+
+
+def _contains(sorted_values, values):
+    """Mask of the values found in the sorted array sorted_values"""
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool)
+    positions = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    return sorted_values[positions] == values
+
+
+def _path_to_root(levels, actor_index):
+    """Actor indices from actor_index back to a root, through the parents of each level"""
+    level = len(levels) - 1
+    while True:
+        actors, _ = levels[level]
+        position = np.searchsorted(actors, actor_index)
+        if position < len(actors) and actors[position] == actor_index:
+            break
+        level -= 1
+    path = [actor_index]
+    while level > 0:
+        actors, parents = levels[level]
+        path.append(int(parents[np.searchsorted(actors, path[-1])]))
+        level -= 1
+    return path
+
+
+def as_python(value):
+    """numpy scalar to python, years and runtimes back to int as stored in MongoDB"""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def as_relation_actor(actor_doc):
+    relation_actor = {"actor_id": actor_doc["_id"]}
+    relation_actor.update({key: value for key, value in actor_doc.items() if key != "_id"})
+    return relation_actor
+
+
+def get_actor_relations(actor_name, db, mode=None):
+    """Local counterpart of queries.get_actor_relations, mode is ignored"""
+    relations = []
+    for actor_index in db.find_actors(actor_name):
+        relations += db.actor_relations(actor_index)
+    return relations
+
+
+def get_actors_relations_by_id(actor_ids, db, mode=None):
+    relations = {}
+    for actor_id in actor_ids:
+        actor_index = db.find_actor_by_id(actor_id)
+        relations[actor_id] = [] if actor_index is None else db.actor_relations(actor_index)
+    return relations
+
+
+def get_movies_by_id(movie_ids, db):
+    movies = {}
+    for movie_id in movie_ids:
+        movie_index = db.find_movie_by_id(movie_id)
+        movies[movie_id] = None if movie_index is None else db.movie_doc(movie_index)
+    return movies
+
+
+def get_actor_info_by_id(actor_id, db):
+    actor_index = db.find_actor_by_id(actor_id)
+    return [] if actor_index is None else [db.actor_doc(actor_index)]
+
+
+def get_actor_info_basic(actor_name, db):
+    return [db.actor_doc(actor_index) for actor_index in db.find_actors(actor_name)]
+
+
+def get_shortest_path(actor_name, other_actor_name, db):
+    """Relations along a shortest chain of co-stars from actor_name to other_actor_name,
+    same shape as get_actor_relations, and the search statistics"""
+    path, stats = db.shortest_path(db.find_actors(actor_name), db.find_actors(other_actor_name))
+    relations = [
+        db.relation_doc(db.actor_doc(actor_index), db.edge_index(actor_index, companion_index))
+        for actor_index, companion_index in zip(path, path[1:])
+    ]
+    return relations, stats
+
+
+def get_random_actor(db, sampler=None):
+    actor_index = None if sampler is None else sampler.sample_found(db.find_actor_by_id)
+    if actor_index is None:
+        # no sampler, or one built for another graph
+        actor_index = random.randrange(len(db))
+    return db.actors["primaryName"][actor_index]
+
+
+def _columns(docs, columns):
+    values = {column: [] for column in columns}
+    for doc in docs:
+        for column in columns:
+            value = doc.get(column)
+            if column in numeric_columns:
+                value = math.nan if value is None else float(value)
+            elif isinstance(value, list):
+                value = ",".join(value)
+            else:
+                value = "" if value is None else str(value)
+            values[column].append(value)
+
+    # sort rows by IMDb id so that ids can be binary searched
+    order = sorted(range(len(values["_id"])), key=values["_id"].__getitem__)
+    arrays = {}
+    for column, column_values in values.items():
+        column_values = [column_values[i] for i in order]
+        if column in numeric_columns:
+            arrays[column] = np.array(column_values, dtype=np.float32)
+        else:
+            arrays[column], arrays[f"{column}_offsets"] = pack_strings(column_values)
+    return arrays
+
+
+def _load_columns(path, prefix, columns):
+    return {
+        column: (
+            _load(path, f"{prefix}_{column}")
+            if column in numeric_columns
+            else StringColumn.load(path, f"{prefix}_{column}")
+        )
+        for column in columns
+    }
+
+
+def cast_pairs(movie_casts):
+    """(source, target, movie) arrays of every pair source < target of actors credited
+    in the same movie. Movies are grouped by cast size, each group is a matrix whose
+    column pairs give the actor pairs of all its movies at once."""
+    casts_by_size = defaultdict(list)
+    for movie_index, cast in movie_casts.items():
+        if len(cast) > 1:
+            casts_by_size[len(cast)].append((movie_index, sorted(cast)))
+    sources, targets, movies = [], [], []
+    for size, casts in casts_by_size.items():
+        movie_indices = np.array([movie_index for movie_index, _ in casts], dtype=np.int32)
+        cast_matrix = np.array([cast for _, cast in casts], dtype=np.int32)
+        rows, columns = np.triu_indices(size, 1)
+        sources.append(cast_matrix[:, rows].ravel())
+        targets.append(cast_matrix[:, columns].ravel())
+        movies.append(np.repeat(movie_indices, len(rows)))
+    if not sources:
+        return (np.zeros(0, dtype=np.int32),) * 3
+    return np.concatenate(sources), np.concatenate(targets), np.concatenate(movies)
+
+
+def build_csr(nb_actors, movie_casts):
+    """movie_casts maps a movie index to the set of actor indices credited in it"""
+    sources, targets, movies = cast_pairs(movie_casts)
+    # one run per actor pair, its movies sorted
+    order = np.lexsort((movies, targets, sources))
+    sources, targets, pair_movies = sources[order], targets[order], movies[order]
+    new_pair = np.ones(len(sources), dtype=bool)
+    new_pair[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+    pair_starts = np.flatnonzero(new_pair)
+    pair_counts = np.diff(np.append(pair_starts, len(sources)))
+    pair_sources, pair_targets = sources[pair_starts], targets[pair_starts]
+
+    # every undirected pair is stored in both directions
+    edge_sources = np.concatenate([pair_sources, pair_targets])
+    edge_targets = np.concatenate([pair_targets, pair_sources])
+    edge_pairs = np.tile(np.arange(len(pair_starts)), 2)
+    order = np.lexsort((edge_targets, edge_sources))
+    edge_pairs = edge_pairs[order]
+
+    offsets = np.zeros(nb_actors + 1, dtype=np.int64)
+    np.cumsum(np.bincount(edge_sources, minlength=nb_actors), out=offsets[1:])
+    neighbors = edge_targets[order].astype(np.int32)
+
+    counts = pair_counts[edge_pairs]
+    edge_movie_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=edge_movie_offsets[1:])
+    # the movie run of each edge pair, back to back
+    first = np.repeat(edge_movie_offsets[:-1], counts)
+    runs = np.repeat(pair_starts[edge_pairs], counts) + np.arange(edge_movie_offsets[-1]) - first
+    return {
+        "offsets": offsets,
+        "neighbors": neighbors,
+        "edge_movie_offsets": edge_movie_offsets,
+        "edge_movies": pair_movies[runs].astype(np.int32),
+    }
+
+
+def write_local_graph(path, actors, movies, principals):
+    """actors and movies are name_basics and title_basics documents,
+    principals yields (movie_id, actor_id) pairs"""
+    actor_arrays = _columns(actors, actor_columns)
+    movie_arrays = _columns(movies, movie_columns)
+    actor_ids = StringColumn(actor_arrays["_id"], actor_arrays["_id_offsets"]).tolist()
+    movie_ids = StringColumn(movie_arrays["_id"], movie_arrays["_id_offsets"]).tolist()
+    actor_index = {actor_id: i for i, actor_id in enumerate(actor_ids)}
+    movie_index = {movie_id: i for i, movie_id in enumerate(movie_ids)}
+
+    movie_casts = defaultdict(set)
+    for movie_id, actor_id in principals:
+        if movie_id in movie_index and actor_id in actor_index:
+            movie_casts[movie_index[movie_id]].add(actor_index[actor_id])
+    csr = build_csr(len(actor_index), movie_casts)
+
+    names = StringColumn(actor_arrays["primaryName"], actor_arrays["primaryName_offsets"])
+    normalized_names = [normalize_name(name) for name in names.tolist()]
+    name_order = sorted(range(len(normalized_names)), key=normalized_names.__getitem__)
+    sorted_names, sorted_name_offsets = pack_strings([normalized_names[i] for i in name_order])
+
+    os.makedirs(path, exist_ok=True)
+    arrays = {f"actor_{column}": array for column, array in actor_arrays.items()}
+    arrays.update({f"movie_{column}": array for column, array in movie_arrays.items()})
+    arrays.update(csr)
+    arrays.update(
+        {
+            "sorted_names": sorted_names,
+            "sorted_names_offsets": sorted_name_offsets,
+            "name_order": np.array(name_order, dtype=np.int32),
+        }
+    )
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), array)
+
+
+def build_from_mongo(db, path):
+    actors = db["name_basics"].find({}, dict.fromkeys(actor_columns, 1))
+    movies = db["title_basics"].find({}, dict.fromkeys(movie_columns, 1))
+    principals = (
+        (principal["movie_id"], principal["actor_id"])
+        for principal in db["title_principal"].find({}, {"_id": 0, "movie_id": 1, "actor_id": 1})
+    )
+    write_local_graph(path, actors, movies, principals)
+
+
+if __name__ == "__main__":
+    # python local_graph.py [output directory]
+    from db import LOCAL_GRAPH_PATH, connect_mongo
+
+    output_path = sys.argv[1] if len(sys.argv) > 1 else LOCAL_GRAPH_PATH
+    build_from_mongo(connect_mongo(), output_path)
+    print(f"Local graph written to {output_path}")
@@ -2,6 +2,11 @@ def actor_selection(actor_name):
     return [{"$match": {"$text": {"$search": f'"{actor_name}"'}}}]
 
 
+def actor_selection_by_ids(actor_ids):
+    # IMDb ids are the _id of name_basics, no text search needed
+    return [{"$match": {"_id": {"$in": list(actor_ids)}}}]
+
+
 giga_query = [
     {
         "$project": {
@@ -23,11 +28,13 @@ giga_query = [
     {"$unwind": {"path": "$main_actor", "preserveNullAndEmptyArrays": False}},
     {
         "$project": {
-            "main_actor.actor_id": "$_id",
-            "main_actor.primaryName": "$primaryName",
-            "main_actor.birthYear": "$birthYear",
-            "main_actor.deathYear": "$deathYear",
-            "main_actor.primaryProfession": "$primaryProfession",
+            "main_actor": {
+                "actor_id": "$_id",
+                "primaryName": "$primaryName",
+                "birthYear": "$birthYear",
+                "deathYear": "$deathYear",
+                "primaryProfession": "$primaryProfession",
+            },
             "movie_id": "$main_actor.movie_id",
         }
     },
@@ -40,8 +47,6 @@ giga_query = [
         }
     },
     {"$unwind": {"path": "$companion_actor", "preserveNullAndEmptyArrays": False}},
-    {"$set": {"companion_actor.primaryProfession": "$companion_actor.category"}},
-    {"$unset": ["companion_actor._id", "companion_actor.movie_id", "companion_actor.category"]},
     {"$match": {"$expr": {"$ne": ["$main_actor.actor_id", "$companion_actor.actor_id"]}}},
     {
         "$lookup": {
@@ -52,76 +57,177 @@ giga_query = [
         }
     },
     {"$unwind": {"path": "$companion_actor_info", "preserveNullAndEmptyArrays": False}},
+    # movie details are fetched with get_movies_by_id when an edge is selected.
+    # Grouped by pair: with several main actors, a shared co-star gives one relation each
     {
-        "$set": {
-            "companion_actor_info": {"$mergeObjects": ["$companion_actor", "$companion_actor_info"]}
+        "$group": {
+            "_id": {"main": "$main_actor.actor_id", "companion": "$companion_actor.actor_id"},
+            "movie_ids": {"$push": "$movie_id"},
+            "main_actor": {"$first": "$main_actor"},
+            "count": {"$sum": 1},
+            "ca_primaryName": {"$first": "$companion_actor_info.primaryName"},
+            "ca_birthYear": {"$first": "$companion_actor_info.birthYear"},
+            "ca_deathYear": {"$first": "$companion_actor_info.deathYear"},
+            # the credited category when name_basics has no profession
+            "ca_primaryProfession": {
+                "$first": {
+                    "$ifNull": [
+                        "$companion_actor_info.primaryProfession",
+                        "$companion_actor.category",
+                    ]
+                }
+            },
+        }
+    },
+    {
+        "$project": {
+            "_id": 0,
+            "movie_ids": 1,
+            "main_actor": 1,
+            "count": 1,
+            "companion_actor": {
+                "actor_id": "$_id.companion",
+                "primaryProfession": "$ca_primaryProfession",
+                "primaryName": "$ca_primaryName",
+                "birthYear": "$ca_birthYear",
+                "deathYear": "$ca_deathYear",
+            },
+        }
+    },
+]
+
+
+# answers from the precomputed actor_edges collection (see build_edges.py),
+# one indexed lookup per endpoint instead of the title_principal join chain
+edges_query = [
+    {
+        "$project": {
+            "_id": 1,
+            "primaryName": 1,
+            "birthYear": 1,
+            "deathYear": 1,
+            "primaryProfession": 1,
         }
     },
-    {"$unset": ["companion_actor", "companion_actor_info._id"]},
     {
         "$lookup": {
-            "from": "title_basics",
-            "localField": "movie_id",
-            "foreignField": "_id",
-            "as": "companion_movie",
+            "from": "actor_edges",
+            "localField": "_id",
+            "foreignField": "source",
+            "as": "edges_as_source",
         }
     },
-    {"$unwind": {"path": "$companion_movie", "preserveNullAndEmptyArrays": False}},
     {
-        "$group": {
-            "_id": "$companion_actor_info.actor_id",
-            "common_movies": {"$push": "$companion_movie"},
-            "main_actor": {"$first": "$main_actor"},
-            "count": {"$count": {}},
-            "ca_category": {"$first": "$companion_actor_info.category"},
-            "ca_primaryName": {"$first": "$companion_actor_info.primaryName"},
-            "ca_birthYear": {"$first": "$companion_actor_info.birthYear"},
-            "ca_deathYear": {"$first": "$companion_actor_info.deathYear"},
-            "ca_primaryProfession": {"$first": "$companion_actor_info.primaryProfession"},
+        "$lookup": {
+            "from": "actor_edges",
+            "localField": "_id",
+            "foreignField": "target",
+            "as": "edges_as_target",
         }
     },
     {
         "$project": {
             "_id": 0,
-            "common_movies": 1,
+            "main_actor": {
+                "actor_id": "$_id",
+                "primaryName": "$primaryName",
+                "birthYear": "$birthYear",
+                "deathYear": "$deathYear",
+                "primaryProfession": "$primaryProfession",
+            },
+            "edge": {"$concatArrays": ["$edges_as_source", "$edges_as_target"]},
+        }
+    },
+    {"$unwind": {"path": "$edge", "preserveNullAndEmptyArrays": False}},
+    {
+        "$project": {
             "main_actor": 1,
-            "count": 1,
-            "companion_actor.actor_id": "$_id",
-            "companion_actor.primaryProfession": "$ca_primaryProfession",
-            "companion_actor.primaryName": "$ca_primaryName",
-            "companion_actor.birthYear": "$ca_birthYear",
-            "companion_actor.deathYear": "$ca_deathYear",
+            "count": "$edge.count",
+            "movie_ids": "$edge.movie_ids",
+            "companion_id": {
+                "$cond": [
+                    {"$eq": ["$edge.source", "$main_actor.actor_id"]},
+                    "$edge.target",
+                    "$edge.source",
+                ]
+            },
         }
     },
     {
-        "$set": {
-            "common_movies": {
-                "$sortArray": {
-                    "input": "$common_movies",
-                    "sortBy": {"releaseYear": 1, "primaryTitle": 1},
-                }
-            }
+        "$lookup": {
+            "from": "name_basics",
+            "localField": "companion_id",
+            "foreignField": "_id",
+            "as": "companion_actor",
+        }
+    },
+    {"$unwind": {"path": "$companion_actor", "preserveNullAndEmptyArrays": False}},
+    {
+        "$project": {
+            "main_actor": 1,
+            "count": 1,
+            "movie_ids": 1,
+            "companion_actor": {
+                "actor_id": "$companion_id",
+                "primaryProfession": "$companion_actor.primaryProfession",
+                "primaryName": "$companion_actor.primaryName",
+                "birthYear": "$companion_actor.birthYear",
+                "deathYear": "$companion_actor.deathYear",
+            },
         }
     },
 ]
 
+relations_queries = {"aggregate": giga_query, "edges": edges_query}
 
-def actor_relations_query(actor_name):
-    return actor_selection(actor_name) + giga_query
 
+def actor_relations_query(actor_name, mode="aggregate"):
+    return actor_selection(actor_name) + relations_queries[mode]
 
-def get_actor_relations(actor_name, db):
-    pipeline = actor_relations_query(actor_name)
+
+def get_actor_relations(actor_name, db, mode="aggregate"):
+    """mode "aggregate" joins title_principal on the fly,
+    mode "edges" reads the materialized actor_edges collection"""
+    pipeline = actor_relations_query(actor_name, mode)
     return list(db["name_basics"].aggregate(pipeline))
 
 
+def get_actors_relations_by_id(actor_ids, db, mode="aggregate"):
+    """Relations of several actors in a single pipeline, grouped by actor id"""
+    pipeline = actor_selection_by_ids(actor_ids) + relations_queries[mode]
+    relations = {actor_id: [] for actor_id in actor_ids}
+    for relation in db["name_basics"].aggregate(pipeline):
+        relations[relation["main_actor"]["actor_id"]].append(relation)
+    return relations
+
+
+def get_movies_by_id(movie_ids, db):
+    """title_basics documents of several movies in a single query, grouped by movie id"""
+    movies = dict.fromkeys(movie_ids)
+    for movie in db["title_basics"].find({"_id": {"$in": list(movie_ids)}}):
+        movies[movie["_id"]] = movie
+    return movies
+
+
+def get_actor_info_by_id(actor_id, db):
+    return list(db["name_basics"].find({"_id": actor_id}))
+
+
 def get_actor_info_basic(actor_name, db):
     pipeline = [{"$match": {"$text": {"$search": f'"{actor_name}"'}}}]
     actor_info = list(db["name_basics"].aggregate(pipeline))
     return actor_info
 
 
-def get_random_actor(db):
+def get_random_actor(db, sampler=None):
+    """With a sampler, one pick among actors with co-stars and a single _id lookup,
+    otherwise, or if the sampler only picked stale ids, a $sample over the whole collection"""
+    if sampler is not None:
+        actor = sampler.sample_found(
+            lambda actor_id: db["name_basics"].find_one({"_id": actor_id}, {"primaryName": 1})
+        )
+        if actor is not None:
+            return actor["primaryName"]
     pipeline = [{"$sample": {"size": 1}}]
     first_result = next(db["name_basics"].aggregate(pipeline))
     actor_name = first_result["primaryName"]
@@ -0,0 +1,107 @@
+import os
+import random
+import sys
+
+import dotenv
+import numpy as np
+
+dotenv.load_dotenv(override=True)
+
+SAMPLER_PATH = os.getenv("SAMPLER_PATH", "data/eligible_actors.npz")
+SAMPLER_WEIGHTED = os.getenv("SAMPLER_WEIGHTED") == "true"
+# picks of ids gone from the database since the sampler was built before giving up
+SAMPLER_ATTEMPTS = 3
+
+degrees_query = [
+    {"$project": {"_id": 0, "actor_id": ["$source", "$target"]}},
+    {"$unwind": "$actor_id"},
+    {"$group": {"_id": "$actor_id", "degree": {"$count": {}}}},
+]
+
+
+def alias_table(weights):
+    """Vose's alias method, turns weighted sampling into one uniform pick and one coin flip"""
+    nb_items = len(weights)
+    probabilities = np.asarray(weights, dtype=np.float64) * nb_items / np.sum(weights)
+    alias = np.arange(nb_items, dtype=np.int64)
+    small = [i for i, p in enumerate(probabilities) if p < 1]
+    large = [i for i, p in enumerate(probabilities) if p >= 1]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        alias[less] = more
+        probabilities[more] -= 1 - probabilities[less]
+        (small if probabilities[more] < 1 else large).append(more)
+    # leftovers only differ from 1 by rounding errors
+    probabilities[small + large] = 1
+    return probabilities, alias
+
+
+class ActorSampler:
+    """Random picks among actors with at least one co-star, in O(1)"""
+
+    def __init__(self, actor_ids, degrees):
+        self.actor_ids = actor_ids
+        self.degrees = degrees
+        self.probabilities, self.alias = alias_table(degrees)
+
+    @classmethod
+    def load(cls, path=SAMPLER_PATH):
+        arrays = np.load(path)
+        sampler = cls.__new__(cls)
+        for name in ["actor_ids", "degrees", "probabilities", "alias"]:
+            setattr(sampler, name, arrays[name])
+        return sampler
+
+    def save(self, path=SAMPLER_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(
+            path,
+            actor_ids=self.actor_ids,
+            degrees=self.degrees,
+            probabilities=self.probabilities,
+            alias=self.alias,
+        )
+
+    def sample(self, weighted=SAMPLER_WEIGHTED):
+        """IMDb id of a random actor, weighted by number of co-stars if asked"""
+        i = random.randrange(len(self.actor_ids))
+        if weighted and random.random() >= self.probabilities[i]:
+            i = self.alias[i]
+        return self.actor_ids[i].item()
+
+    def sample_found(self, find, attempts=SAMPLER_ATTEMPTS):
+        """find(actor_id) of the first random actor it does not return None for,
+        None if every attempt picked a stale id"""
+        for _ in range(attempts):
+            found = find(self.sample())
+            if found is not None:
+                return found
+        return None
+
+
+def sampler_from_mongo(db):
+    """Degrees come from the actor_edges collection built by build_edges.py"""
+    actor_degrees = list(db["actor_edges"].aggregate(degrees_query, allowDiskUse=True))
+    actor_ids = np.array([entry["_id"] for entry in actor_degrees], dtype=str)
+    degrees = np.array([entry["degree"] for entry in actor_degrees], dtype=np.int32)
+    return ActorSampler(actor_ids, degrees)
+
+
+def sampler_from_local_graph(graph):
+    degrees = np.diff(graph.offsets).astype(np.int32)
+    eligible = np.flatnonzero(degrees)
+    actor_ids = np.array(graph.actors["_id"].take(eligible), dtype=str)
+    return ActorSampler(actor_ids, degrees[eligible])
+
+
+if __name__ == "__main__":
+    # python sampler.py [output path], reads from the configured GRAPH_BACKEND
+    from db import GRAPH_BACKEND, database
+
+    output_path = sys.argv[1] if len(sys.argv) > 1 else SAMPLER_PATH
+    if GRAPH_BACKEND == "local":
+        sampler = sampler_from_local_graph(database)
+    else:
+        sampler = sampler_from_mongo(database)
+    sampler.save(output_path)
+    print(f"{len(sampler.actor_ids)} eligible actors written to {output_path}")
@@ -0,0 +1,194 @@
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import dotenv
+
+from cache import SQLiteStore
+
+dotenv.load_dotenv(override=True)
+
+SESSION_PATH = os.getenv("SESSION_PATH", "sessions.sqlite3")
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(24 * 3600)))
+# values kept deserialized in each worker, by session and key
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "32"))
+# a lock older than this is taken over, in case the worker holding it died
+SESSION_LOCK_SECONDS = 30
+LOCK_POLL_SECONDS = 0.005
+# returned by an update function to leave the stored value as it is
+UNCHANGED = object()
+
+session_schema = [
+    """CREATE TABLE IF NOT EXISTS session_values (
+        session_id TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value BLOB NOT NULL,
+        updated REAL NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (session_id, key)
+    )""",
+    "CREATE INDEX IF NOT EXISTS session_values_updated ON session_values (updated)",
+    """CREATE TABLE IF NOT EXISTS session_locks (
+        session_id TEXT NOT NULL,
+        key TEXT NOT NULL,
+        owner TEXT NOT NULL,
+        expires REAL NOT NULL,
+        PRIMARY KEY (session_id, key)
+    )""",
+]
+
+
+class SessionStore(SQLiteStore):
+    """Server-side state of each browser session, e.g. the authoritative graph.
+    Sessions untouched for longer than ttl are dropped.
+
+    Each value has a version, bumped on every write. Workers keep the values they last
+    read or wrote deserialized, and only unpickle them again when the version moved.
+    Updates lock a single value rather than the whole database, and run outside of any
+    SQLite transaction."""
+
+    schema = session_schema
+
+    def __init__(self, path=SESSION_PATH, ttl=SESSION_TTL_SECONDS, cache_size=SESSION_CACHE_SIZE):
+        super().__init__(path)
+        connection = self._connection()
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(session_values)")]
+        if "version" not in columns:
+            # session files written before values were versioned
+            connection.execute(
+                "ALTER TABLE session_values ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
+            )
+        self.ttl = ttl
+        self.cache_size = cache_size
+        # (session id, key) -> (version, value), least recently used first
+        self._values = OrderedDict()
+        self._values_lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _cached(self, session_id, key, version):
+        with self._values_lock:
+            if self._pid != os.getpid():
+                # forked worker, the parent cache is not shared
+                self._values.clear()
+                self._pid = os.getpid()
+            cached = self._values.get((session_id, key))
+            if cached is None or cached[0] != version:
+                return None
+            self._values.move_to_end((session_id, key))
+            return cached
+
+    def _cache(self, session_id, key, version, value):
+        with self._values_lock:
+            self._values[(session_id, key)] = (version, value)
+            self._values.move_to_end((session_id, key))
+            while len(self._values) > self.cache_size:
+                self._values.popitem(last=False)
+
+    def _forget(self, session_id, key):
+        with self._values_lock:
+            self._values.pop((session_id, key), None)
+
+    def _read(self, session_id, key, default):
+        """(version, value), version 0 and default if there is no value"""
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT version FROM session_values WHERE session_id = ? AND key = ?",
+            (session_id, key),
+        ).fetchone()
+        if row is None:
+            return 0, default
+        cached = self._cached(session_id, key, row[0])
+        if cached is not None:
+            return cached
+        row = connection.execute(
+            "SELECT version, value FROM session_values WHERE session_id = ? AND key = ?",
+            (session_id, key),
+        ).fetchone()
+        version, value = row[0], pickle.loads(row[1])
+        self._cache(session_id, key, version, value)
+        return version, value
+
+    def _write(self, session_id, key, value, version=None):
+        """Stores value with the next version, returns the new version.
+        With version, only replaces the value of that version, e.g. the one read under a
+        lock that expired meanwhile, and raises RuntimeError if it was written since."""
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        with self._transaction() as connection:
+            if version is None:
+                row = connection.execute(
+                    "SELECT version FROM session_values WHERE session_id = ? AND key = ?",
+                    (session_id, key),
+                ).fetchone()
+                version = 0 if row is None else row[0]
+            cursor = connection.execute(
+                """INSERT INTO session_values VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (session_id, key) DO UPDATE
+                SET value = excluded.value, updated = excluded.updated, version = excluded.version
+                WHERE version = ?""",
+                (session_id, key, blob, now, version + 1, version),
+            )
+            if not cursor.rowcount:
+                raise RuntimeError(f"{key} of session {session_id} was written meanwhile")
+            connection.execute("DELETE FROM session_values WHERE updated < ?", (now - self.ttl,))
+        self._cache(session_id, key, version + 1, value)
+        return version + 1
+
+    @contextmanager
+    def _lock(self, session_id, key):
+        """Lock of a single value, polled for, held without any open transaction so that
+        other sessions are read and written meanwhile"""
+        connection = self._connection()
+        owner = uuid.uuid4().hex
+        while True:
+            now = time.time()
+            cursor = connection.execute(
+                """INSERT INTO session_locks VALUES (?, ?, ?, ?)
+                ON CONFLICT (session_id, key) DO UPDATE
+                SET owner = excluded.owner, expires = excluded.expires WHERE expires < ?""",
+                (session_id, key, owner, now + SESSION_LOCK_SECONDS, now),
+            )
+            if cursor.rowcount:
+                break
+            time.sleep(LOCK_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            connection.execute(
+                "DELETE FROM session_locks WHERE session_id = ? AND key = ? AND owner = ?",
+                (session_id, key, owner),
+            )
+
+    def get(self, session_id, key, default=None):
+        """The value shared with this worker cache, to be read and not modified"""
+        return self._read(session_id, key, default)[1]
+
+    def get_version(self, session_id, key):
+        """Version of the value, 0 if there is none"""
+        return self._read(session_id, key, None)[0]
+
+    def set(self, session_id, key, value):
+        self._write(session_id, key, value)
+
+    def update(self, session_id, key, update_function, default=None):
+        """Atomically replaces the stored value by update_function(value),
+        returns the previous and the new value.
+        update_function may modify value in place, it is not stored if it raises.
+        It returns UNCHANGED when nothing other workers need changed, the value then
+        stays as modified in this worker cache only."""
+        with self._lock(session_id, key):
+            version, value = self._read(session_id, key, default)
+            try:
+                new_value = update_function(value)
+                if new_value is UNCHANGED:
+                    return value, value
+                self._write(session_id, key, new_value, version)
+            except BaseException:
+                # value may be half updated or not stored, read it again next time
+                self._forget(session_id, key)
+                raise
+        return value, new_value
@@ -0,0 +1,249 @@
+import hashlib
+import io
+import os
+import time
+
+import dotenv
+import numpy as np
+
+from cache import SQLiteStore
+from local_graph import (
+    StringColumn,
+    actor_columns,
+    as_python,
+    movie_columns,
+    numeric_columns,
+    pack_strings,
+)
+
+dotenv.load_dotenv(override=True)
+
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "snapshots.sqlite3")
+SNAPSHOT_MAX_BYTES = int(os.getenv("SNAPSHOT_MAX_MB", "20")) * 2**20
+SNAPSHOT_VERSION = 1
+
+# node data kept in a snapshot, degree and filtered are computed again on load
+node_columns = ["id", "label", "actor_id"] + actor_columns[1:]
+
+snapshot_schema = [
+    """CREATE TABLE IF NOT EXISTS snapshots (
+        snapshot_id TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        created REAL NOT NULL
+    )""",
+]
+
+
+class StringTable:
+    """Interned strings, each one stored once and referred to by its index"""
+
+    def __init__(self):
+        self.indices = {}
+
+    def index(self, value):
+        if value is None:
+            return -1
+        if isinstance(value, list):
+            value = ",".join(value)
+        return self.indices.setdefault(str(value), len(self.indices))
+
+    def pack(self):
+        return pack_strings(self.indices)
+
+
+def _columns(docs, columns, strings):
+    arrays = {}
+    for column in columns:
+        values = [doc.get(column) for doc in docs]
+        if column in numeric_columns:
+            arrays[column] = np.array(
+                [np.nan if value is None else value for value in values], dtype=np.float64
+            )
+        else:
+            arrays[column] = np.array([strings.index(value) for value in values], dtype=np.int32)
+    return arrays
+
+
+def _docs(arrays, prefix, columns, strings, length):
+    docs = [{} for _ in range(length)]
+    for column in columns:
+        values = arrays[f"{prefix}_{column}"]
+        if column in numeric_columns:
+            for doc, value in zip(docs, values):
+                doc[column] = as_python(value)
+        else:
+            for doc, value in zip(docs, values.tolist()):
+                if value >= 0:
+                    doc[column] = strings[value]
+    return docs
+
+
+def dump_snapshot(graph):
+    """Compressed binary snapshot of the nodes, edges, movie table and positions of graph.
+    Strings are interned in a single table, edges are pairs of node indices."""
+    strings = StringTable()
+    nodes = [graph.get(node_id) for node_id in graph.adjacency]
+    node_index = {node["data"]["id"]: i for i, node in enumerate(nodes)}
+    edges = [element for element in graph.elements if "source" in element["data"]]
+
+    arrays = {"version": np.array([SNAPSHOT_VERSION])}
+    node_arrays = _columns([node["data"] for node in nodes], node_columns, strings)
+    arrays.update({f"node_{column}": array for column, array in node_arrays.items()})
+    if any("position" in node for node in nodes):
+        # unplaced nodes are NaN
+        positions = np.full((len(nodes), 2), np.nan)
+        for i, node in enumerate(nodes):
+            if "position" in node:
+                positions[i] = node["position"]["x"], node["position"]["y"]
+        arrays["node_position"] = positions
+
+    arrays["edge_nodes"] = np.array(
+        [
+            [node_index[edge["data"]["source"]], node_index[edge["data"]["target"]]]
+            for edge in edges
+        ],
+        dtype=np.int32,
+    ).reshape(-1, 2)
+    edge_movie_ids = [edge["data"].get("movie_ids", []) for edge in edges]
+    arrays["edge_movie_offsets"] = np.zeros(len(edges) + 1, dtype=np.int64)
+    np.cumsum(
+        [len(movie_ids) for movie_ids in edge_movie_ids], out=arrays["edge_movie_offsets"][1:]
+    )
+    arrays["edge_movies"] = np.array(
+        [strings.index(movie_id) for movie_ids in edge_movie_ids for movie_id in movie_ids],
+        dtype=np.int32,
+    )
+
+    movie_arrays = _columns(list(graph.movies.values()), movie_columns, strings)
+    arrays.update({f"movie_{column}": array for column, array in movie_arrays.items()})
+
+    arrays["strings"], arrays["string_offsets"] = strings.pack()
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def _check_indices(array, size, name):
+    """Raises ValueError unless array holds integers in [0, size)"""
+    if array.dtype.kind not in "iu":
+        raise ValueError(f"{name} are not integers")
+    if array.size and (array.min() < 0 or array.max() >= size):
+        raise ValueError(f"{name} out of range")
+
+
+def _check_offsets(offsets, length, total, name):
+    """Raises ValueError unless offsets split total values into length slices"""
+    _check_indices(offsets, total + 1, name)
+    if len(offsets) != length + 1 or offsets[0] != 0 or offsets[-1] != total:
+        raise ValueError(f"{name} do not match their values")
+    if np.any(np.diff(offsets) < 0):
+        raise ValueError(f"{name} are not sorted")
+
+
+def _read_snapshot(data):
+    """nodes, edges, movies and positions of a snapshot, checked and decoded"""
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        arrays = {name: npz[name] for name in npz.files}
+    if arrays["version"][0] != SNAPSHOT_VERSION:
+        raise ValueError(f"unsupported snapshot version {arrays['version'][0]}")
+    _check_offsets(
+        arrays["string_offsets"],
+        len(arrays["string_offsets"]) - 1,
+        len(arrays["strings"]),
+        "string offsets",
+    )
+    strings = StringColumn(arrays["strings"], arrays["string_offsets"]).tolist()
+    nb_nodes = len(arrays["node_id"])
+    nb_movies = len(arrays["movie__id"])
+    for prefix, columns, length in [
+        ("node", node_columns, nb_nodes),
+        ("movie", movie_columns, nb_movies),
+    ]:
+        for column in columns:
+            values = arrays[f"{prefix}_{column}"]
+            if len(values) != length:
+                raise ValueError(f"{prefix} {column} has {len(values)} values, not {length}")
+            if column not in numeric_columns:
+                # -1 is a missing value
+                _check_indices(values + 1, len(strings) + 1, f"{prefix} {column} strings")
+    nodes = _docs(arrays, "node", node_columns, strings, nb_nodes)
+    movies = _docs(arrays, "movie", movie_columns, strings, nb_movies)
+    if any("id" not in node for node in nodes) or any("_id" not in movie for movie in movies):
+        raise ValueError("missing node or movie id")
+
+    edge_nodes = arrays["edge_nodes"]
+    if edge_nodes.ndim != 2 or edge_nodes.shape[1] != 2:
+        raise ValueError("edge nodes are not pairs")
+    _check_indices(edge_nodes, nb_nodes, "edge nodes")
+    _check_indices(arrays["edge_movies"], len(strings), "edge movies")
+    _check_offsets(
+        arrays["edge_movie_offsets"], len(edge_nodes), len(arrays["edge_movies"]), "edge offsets"
+    )
+    edge_movies = [strings[movie] for movie in arrays["edge_movies"].tolist()]
+    edge_movie_offsets = arrays["edge_movie_offsets"].tolist()
+    edges = []
+    for i, (source, target) in enumerate(edge_nodes.tolist()):
+        source_id, target_id = nodes[source]["id"], nodes[target]["id"]
+        edges.append(
+            {
+                "id": f"{source_id} , {target_id}",
+                "source": source_id,
+                "target": target_id,
+                "movie_ids": edge_movies[edge_movie_offsets[i] : edge_movie_offsets[i + 1]],
+            }
+        )
+
+    positions = []
+    if "node_position" in arrays:
+        if arrays["node_position"].shape != (nb_nodes, 2):
+            raise ValueError("node positions do not match the nodes")
+        for data_node, (x, y) in zip(nodes, arrays["node_position"].astype(float).tolist()):
+            if not np.isnan(x):
+                positions.append((data_node["id"], x, y))
+    return nodes, edges, movies, positions
+
+
+def load_snapshot(data, graph):
+    """Replaces the content of graph by the snapshot, without any database query.
+    Raises ValueError, leaving graph untouched, if data is not a valid snapshot."""
+    try:
+        nodes, edges, movies, positions = _read_snapshot(data)
+    except Exception as error:
+        # zipfile, zlib and the npy header parser raise all kinds of errors on corrupted files
+        raise ValueError(f"not a graph snapshot ({error})") from error
+
+    graph.clear()
+    for data_node in nodes:
+        graph.add_node(data_node)
+    for data_edge in edges:
+        graph.add_edge(data_edge)
+    graph.add_movies(movies)
+    for node_id, x, y in positions:
+        graph.set_position(node_id, x, y)
+    return graph
+
+
+class SnapshotStore(SQLiteStore):
+    """Snapshots shared by id, the id is a hash of the snapshot so that saving
+    the same graph twice gives the same id"""
+
+    schema = snapshot_schema
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        super().__init__(path)
+
+    def put(self, data):
+        snapshot_id = hashlib.sha256(data).hexdigest()[:16]
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO snapshots VALUES (?, ?, ?)", (snapshot_id, data, time.time())
+            )
+        return snapshot_id
+
+    def get(self, snapshot_id):
+        row = (
+            self._connection()
+            .execute("SELECT value FROM snapshots WHERE snapshot_id = ?", (snapshot_id,))
+            .fetchone()
+        )
+        return None if row is None else row[0]
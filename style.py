@@ -39,6 +39,17 @@ default_stylesheet = [
             "text-outline-width": "1px",
         },
     },
+    # communities of the level of detail view, see clustering.py
+    {
+        "selector": "node[members]",
+        "style": {
+            "width": "mapData(members, 2, 500, 35, 150)",
+            "height": "mapData(members, 2, 500, 35, 150)",
+            "shape": "round-rectangle",
+            "background-color": "purple",
+            "font-size": 10,
+        },
+    },
     {
         "selector": "node:selected",
         "style": {
@@ -61,6 +72,12 @@ default_stylesheet = [
             "line-style": "solid",
         },
     },
+    {
+        "selector": "edge[weight]",
+        "style": {
+            "width": "mapData(weight, 1, 100, 2, 12)",
+        },
+    },
     {
         "selector": "edge:selected",
         "style": {
@@ -79,3 +96,17 @@ default_stylesheet = [
         },
     },
 ]
+
+# appended to default_stylesheet while the on-graph filter is active,
+# matching elements are flagged with data(filtered) by GraphState.set_filter
+filter_stylesheet = [
+    {"selector": "node", "style": {"opacity": 0.3}},
+    {
+        "selector": "edge",
+        "style": {
+            "opacity": 0.2,
+        },
+    },
+    {"selector": "node[?filtered]", "style": {"opacity": 1, "z-index": 10}},
+    {"selector": "edge[?filtered]", "style": {"opacity": 1, "z-index": 9}},
+]
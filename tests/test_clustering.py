@@ -0,0 +1,26 @@
+from clustering import MAX_COMMUNITY_SIZE, MIN_COMMUNITY_SIZE, OTHERS, detect_communities
+from utils import GraphState
+
+
+def test_costars_of_full_communities_are_not_left_over():
+    """Co-stars of hubs whose community is full used to stay alone, and all
+    but the first MAX_COMMUNITIES of them ended up in a single huge OTHERS"""
+    graph = GraphState()
+    hubs = [f"Hub {i}" for i in range(3)]
+    for hub in hubs:
+        graph.add_node({"id": hub})
+        for i in range(2 * MAX_COMMUNITY_SIZE):
+            costar = f"{hub} costar {i}"
+            graph.add_node({"id": costar})
+            graph.add_edge({"id": f"{hub} , {costar}", "source": hub, "target": costar})
+    for i in range(5):
+        graph.add_node({"id": f"Lonely {i}"})
+
+    communities = detect_communities(graph)
+    assert OTHERS not in communities
+    sizes = [len(members) for members in communities.values()]
+    assert max(sizes) <= MAX_COMMUNITY_SIZE
+    assert sum(sizes) == len(graph.adjacency)
+    # each hub and its co-stars fill 3 communities, the lonely actors get one
+    assert len(communities) == 10
+    assert sum(size < MIN_COMMUNITY_SIZE for size in sizes) == 4
@@ -0,0 +1,80 @@
+import json
+import pickle
+import random
+
+import pytest
+
+from utils import GraphState
+
+names = ["Will Smith", "Margot Robbie", "Jada Pinkett", "Zoé Saldaña", "Lonely Guy", "Ada Moreau"]
+filters = ["", "smith", "a", "zoe", "jada pinket", "xyz"]
+
+
+def apply_patch(elements, patch):
+    """What the Dash renderer does with a Patch of cyto_graph.elements"""
+    operations = json.loads(json.dumps(patch.to_plotly_json()))["operations"]
+    for operation in operations:
+        location = operation["location"]
+        if operation["operation"] == "Extend":
+            # appends to the list at location, the root for new elements
+            target = elements
+            for key in location:
+                target = target[key]
+            target.extend(operation["params"]["value"])
+            continue
+        *parents, last = location
+        target = elements
+        for key in parents:
+            target = target[key]
+        if operation["operation"] == "Assign":
+            target[last] = operation["params"]["value"]
+        elif operation["operation"] == "Delete":
+            del target[last]
+        else:
+            raise ValueError(operation["operation"])
+    return elements
+
+
+def random_change(graph, rng):
+    node_ids = list(graph.adjacency)
+    action = rng.choice(["add_node", "add_edge", "remove_node", "filter", "move"])
+    if action == "add_node":
+        graph.add_node({"id": rng.choice(names)})
+    elif action == "add_edge" and len(node_ids) > 1:
+        source, target = rng.sample(node_ids, 2)
+        graph.add_edge(
+            {"id": f"{source} , {target}", "source": source, "target": target, "movie_ids": []}
+        )
+    elif action == "remove_node" and node_ids:
+        graph.remove_node(rng.choice(node_ids))
+    elif action == "filter":
+        graph.set_filter(rng.choice(filters))
+    elif action == "move" and node_ids:
+        graph.set_position(rng.choice(node_ids), rng.random(), rng.random())
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_patches_replay_to_elements(seed):
+    """Swapping removed slots with the last element must keep the client list in sync"""
+    rng = random.Random(seed)
+    graph = GraphState()
+    client_elements = []
+    for _ in range(30):
+        for _ in range(rng.randint(1, 8)):
+            random_change(graph, rng)
+        apply_patch(client_elements, graph.flush_patch())
+        assert client_elements == json.loads(json.dumps(graph.to_elements()))
+
+
+def test_position_grid_follows_positions():
+    graph = GraphState()
+    for i, name in enumerate(names):
+        graph.add_node({"id": name})
+        graph.set_position(name, 30.0 * i, 0.0)
+    graph.set_position("Ada Moreau", 1000.0, 1000.0)
+    graph.remove_node("Jada Pinkett")
+    assert graph.position_grid.around(0.0, 0.0, 70.0) == {"Will Smith", "Margot Robbie"}
+
+    unpickled = pickle.loads(pickle.dumps(graph))
+    assert unpickled.__dict__["_position_grid"] is None
+    assert unpickled.position_grid.around(1000.0, 1000.0, 1.0) == {"Ada Moreau"}
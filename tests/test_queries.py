@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+import local_graph
+import queries
+from build_edges import build_actor_edges
+from sampler import ActorSampler
+
+actors = [
+    {"_id": "nm01", "primaryName": "Will Smith", "primaryProfession": "actor"},
+    {"_id": "nm02", "primaryName": "Margot Robbie", "primaryProfession": "actress"},
+    {"_id": "nm03", "primaryName": "Jada Pinkett", "primaryProfession": "actress"},
+    {"_id": "nm04", "primaryName": "Lonely Guy", "primaryProfession": "actor"},
+]
+movies = [
+    {"_id": "tt01", "primaryTitle": "Focus"},
+    {"_id": "tt02", "primaryTitle": "Ali"},
+    {"_id": "tt03", "primaryTitle": "Babylon"},
+]
+# Jada Pinkett is a co-star of both Will Smith and Margot Robbie
+principals = [
+    ("tt01", "nm01"),
+    ("tt01", "nm02"),
+    ("tt02", "nm01"),
+    ("tt02", "nm03"),
+    ("tt03", "nm02"),
+    ("tt03", "nm03"),
+]
+
+
+@pytest.fixture
+def mongo_db():
+    mongomock = pytest.importorskip("mongomock")
+    db = mongomock.MongoClient().db
+    db["name_basics"].insert_many([dict(actor) for actor in actors])
+    db["title_basics"].insert_many([dict(movie) for movie in movies])
+    db["title_principal"].insert_many(
+        [
+            {"movie_id": movie_id, "actor_id": actor_id, "category": "actor"}
+            for movie_id, actor_id in principals
+        ]
+    )
+    return db
+
+
+@pytest.fixture
+def local_db(tmp_path):
+    local_graph.write_local_graph(str(tmp_path / "graph"), actors, movies, principals)
+    return local_graph.LocalGraph(str(tmp_path / "graph"))
+
+
+def relation_pairs(relations):
+    return {
+        main_id: {
+            relation["companion_actor"]["actor_id"]: (
+                relation["count"],
+                sorted(relation["movie_ids"]),
+            )
+            for relation in main_relations
+            if relation["main_actor"]["actor_id"] == main_id
+        }
+        for main_id, main_relations in relations.items()
+    }
+
+
+expected_pairs = {
+    "nm01": {"nm02": (1, ["tt01"]), "nm03": (1, ["tt02"])},
+    "nm02": {"nm01": (1, ["tt01"]), "nm03": (1, ["tt03"])},
+    "nm04": {},
+}
+
+
+@pytest.mark.parametrize("mode", ["aggregate", "edges"])
+def test_shared_costar_mongo(mongo_db, mode):
+    build_actor_edges(mongo_db)
+    relations = queries.get_actors_relations_by_id(["nm01", "nm02", "nm04"], mongo_db, mode)
+    assert relation_pairs(relations) == expected_pairs
+
+
+def test_shared_costar_local(local_db):
+    relations = local_graph.get_actors_relations_by_id(["nm01", "nm02", "nm04"], local_db)
+    assert relation_pairs(relations) == expected_pairs
+
+
+def test_random_actor_with_stale_sampler(mongo_db, local_db):
+    stale_sampler = ActorSampler(np.array(["nm99"]), np.array([1]))
+    names = {actor["primaryName"] for actor in actors}
+    assert queries.get_random_actor(mongo_db, stale_sampler) in names
+    assert local_graph.get_random_actor(local_db, stale_sampler) in names
@@ -0,0 +1,82 @@
+import pickle
+
+import pytest
+
+from sessions import UNCHANGED, SessionStore
+from utils import GraphState
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SessionStore(str(tmp_path / "sessions.sqlite3"))
+
+
+def test_update_bumps_version_and_caches(store, tmp_path):
+    store.update(
+        "s", "graph", lambda graph: graph.add_node({"id": "Will Smith"}) and graph, GraphState()
+    )
+    assert store.get_version("s", "graph") == 1
+    # the worker cache hands back the value it wrote
+    assert store.get("s", "graph") is store.get("s", "graph")
+
+    other_worker = SessionStore(str(tmp_path / "sessions.sqlite3"))
+    other_worker.update(
+        "s", "graph", lambda graph: graph.add_node({"id": "Jada Pinkett"}) and graph
+    )
+    graph = store.get("s", "graph")
+    assert store.get_version("s", "graph") == 2
+    assert set(graph.adjacency) == {"Will Smith", "Jada Pinkett"}
+
+
+def test_failed_update_is_not_stored(store):
+    store.set("s", "graph", GraphState())
+
+    def fail(graph):
+        graph.add_node({"id": "Will Smith"})
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        store.update("s", "graph", fail)
+    assert store.get_version("s", "graph") == 1
+    assert not store.get("s", "graph").adjacency
+
+
+def test_write_after_lock_expiry_does_not_overwrite(store, tmp_path):
+    store.set("s", "graph", GraphState())
+    other_worker = SessionStore(str(tmp_path / "sessions.sqlite3"))
+
+    def slow_add(graph):
+        # the lock expired meanwhile and another worker stored a newer graph
+        newer = GraphState()
+        newer.add_node({"id": "Jada Pinkett"})
+        other_worker._write("s", "graph", newer)
+        graph.add_node({"id": "Will Smith"})
+        return graph
+
+    with pytest.raises(RuntimeError):
+        store.update("s", "graph", slow_add)
+    assert store.get_version("s", "graph") == 2
+    assert set(store.get("s", "graph").adjacency) == {"Jada Pinkett"}
+
+
+def test_unchanged_update_is_not_written(store):
+    store.set("s", "graph", GraphState())
+    previous, new = store.update("s", "graph", lambda graph: UNCHANGED)
+    assert new is previous
+    assert store.get_version("s", "graph") == 1
+
+
+def test_derived_indexes_are_not_pickled():
+    graph = GraphState()
+    for name in ["Will Smith", "Jada Pinkett"]:
+        graph.add_node({"id": name})
+    graph.set_filter("smith")
+    state = pickle.loads(pickle.dumps(graph)).__dict__
+    assert state["_name_index"] is None and state["communities"] is None
+
+    unpickled = pickle.loads(pickle.dumps(graph))
+    unpickled.set_filter("")
+    unpickled.add_node({"id": "Jada Smith"})
+    unpickled.remove_node("Will Smith")
+    unpickled.set_filter("smith")
+    assert unpickled.filtered == {"Jada Smith"}
@@ -0,0 +1,60 @@
+import io
+
+import numpy as np
+import pytest
+
+from snapshot import dump_snapshot, load_snapshot
+from utils import GraphState
+
+
+def small_graph():
+    graph = GraphState()
+    for actor_id, name in [("nm1", "Will Smith"), ("nm2", "Margot Robbie"), ("nm3", "Ada")]:
+        graph.add_node({"id": name, "label": name, "actor_id": actor_id})
+    graph.add_edge(
+        {"id": "Will Smith , Ada", "source": "Will Smith", "target": "Ada", "movie_ids": ["tt1"]}
+    )
+    graph.set_position("Ada", 1.0, 2.0)
+    return graph
+
+
+def with_array(snapshot, name, array):
+    with np.load(io.BytesIO(snapshot)) as npz:
+        arrays = {key: npz[key] for key in npz.files}
+    arrays[name] = array
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def test_snapshot_round_trip():
+    graph = load_snapshot(dump_snapshot(small_graph()), GraphState())
+    assert set(graph.adjacency) == {"Will Smith", "Margot Robbie", "Ada"}
+    assert graph.get("Will Smith , Ada")["data"]["movie_ids"] == ["tt1"]
+    assert graph.get("Ada")["position"] == {"x": 1.0, "y": 2.0}
+
+
+def corrupted_snapshots():
+    snapshot = dump_snapshot(small_graph())
+    flipped = bytearray(snapshot)
+    flipped[len(flipped) // 3] ^= 0xFF
+    return [
+        b"not a zip",
+        bytes(flipped),
+        with_array(snapshot, "edge_nodes", np.array([[0, 7]], dtype=np.int32)),
+        with_array(snapshot, "edge_nodes", np.array([[0, -1]], dtype=np.int32)),
+        with_array(snapshot, "edge_nodes", np.array([[0.0, 1.0]])),
+        with_array(snapshot, "edge_movies", np.array([99], dtype=np.int32)),
+        with_array(snapshot, "edge_movie_offsets", np.array([0, 5], dtype=np.int64)),
+        with_array(snapshot, "node_label", np.array([0, 99, 1], dtype=np.int32)),
+        with_array(snapshot, "node_id", np.array([0, -1, 1], dtype=np.int32)),
+    ]
+
+
+@pytest.mark.parametrize("snapshot", corrupted_snapshots())
+def test_invalid_snapshot_leaves_graph_untouched(snapshot):
+    graph = GraphState()
+    graph.add_node({"id": "Zoé Saldaña"})
+    with pytest.raises(ValueError):
+        load_snapshot(snapshot, graph)
+    assert list(graph.adjacency) == ["Zoé Saldaña"]
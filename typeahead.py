@@ -0,0 +1,145 @@
+import os
+import sys
+
+import dotenv
+import numpy as np
+
+from formatting import normalize_name
+from local_graph import StringColumn, pack_strings
+
+dotenv.load_dotenv(override=True)
+
+# directory of .npy files, memory-mapped so that workers share their pages
+TYPEAHEAD_PATH = os.getenv("TYPEAHEAD_PATH", "data/typeahead")
+
+# prefixes up to this length match too many names to rank on the fly,
+# their top suggestions are computed when the index is built
+SHORT_PREFIX_LENGTH = 2
+TOP_K = 10
+# sorts after any character of a normalized name
+PREFIX_END = "\U0010ffff"
+
+
+class TypeaheadIndex:
+    """Sorted column of normalized actor names, answering prefix queries by binary search.
+    Suggestions are ranked by number of co-stars."""
+
+    def __init__(self, names, display_names, degrees, short_prefixes, short_prefix_top):
+        self.names = names
+        self.display_names = display_names
+        self.degrees = degrees
+        self.short_prefix_top = dict(zip(short_prefixes.tolist(), short_prefix_top))
+
+    @classmethod
+    def build(cls, display_names, degrees):
+        """display_names is a list, degrees an array of the same length"""
+        normalized_names = [normalize_name(name) for name in display_names]
+        order = sorted(range(len(normalized_names)), key=normalized_names.__getitem__)
+        names = StringColumn(*pack_strings([normalized_names[i] for i in order]))
+        display_names = StringColumn(*pack_strings([display_names[i] for i in order]))
+        degrees = np.asarray(degrees, dtype=np.int32)[order]
+
+        short_prefixes = sorted(
+            {
+                name[:length]
+                for name in names.tolist()
+                for length in range(1, SHORT_PREFIX_LENGTH + 1)
+            }
+        )
+        short_prefix_top = np.full((len(short_prefixes), TOP_K), -1, dtype=np.int32)
+        for i, prefix in enumerate(short_prefixes):
+            top = cls._rank(names, degrees, prefix, TOP_K)
+            short_prefix_top[i, : len(top)] = top
+        return cls(
+            names,
+            display_names,
+            degrees,
+            StringColumn(*pack_strings(short_prefixes)),
+            short_prefix_top,
+        )
+
+    @classmethod
+    def load(cls, path=TYPEAHEAD_PATH):
+        return cls(
+            StringColumn.load(path, "names"),
+            StringColumn.load(path, "display_names"),
+            np.load(os.path.join(path, "degrees.npy"), mmap_mode="r"),
+            StringColumn.load(path, "short_prefixes"),
+            np.load(os.path.join(path, "short_prefix_top.npy")),
+        )
+
+    def save(self, path=TYPEAHEAD_PATH):
+        os.makedirs(path, exist_ok=True)
+        short_prefixes = pack_strings(self.short_prefix_top.keys())
+        short_prefix_top = np.array(list(self.short_prefix_top.values()), dtype=np.int32)
+        arrays = {
+            "names": self.names.blob,
+            "names_offsets": self.names.offsets,
+            "display_names": self.display_names.blob,
+            "display_names_offsets": self.display_names.offsets,
+            "degrees": self.degrees,
+            "short_prefixes": short_prefixes[0],
+            "short_prefixes_offsets": short_prefixes[1],
+            "short_prefix_top": short_prefix_top.reshape(-1, TOP_K),
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), array)
+
+    @staticmethod
+    def _rank(names, degrees, prefix, k):
+        """Indices of the k names starting with prefix with the most co-stars"""
+        start = names.searchsorted(prefix, side="left")
+        end = names.searchsorted(prefix + PREFIX_END, side="left")
+        candidates = -degrees[start:end]
+        if len(candidates) > k:
+            top = np.argpartition(candidates, k)[:k]
+        else:
+            top = np.arange(len(candidates))
+        # stable sort keeps alphabetical order between equal degrees
+        top = np.sort(top)
+        top = top[np.argsort(candidates[top], kind="stable")]
+        return start + top
+
+    def suggest(self, query, k=TOP_K):
+        prefix = normalize_name(query)
+        if not prefix:
+            return []
+        if len(prefix) <= SHORT_PREFIX_LENGTH and k <= TOP_K:
+            top = self.short_prefix_top.get(prefix, [])
+            top = [i for i in top if i >= 0]
+        else:
+            top = self._rank(self.names, self.degrees, prefix, k)
+        # namesakes show up once
+        return list(dict.fromkeys(self.display_names[i] for i in top))[:k]
+
+
+def typeahead_from_mongo(db):
+    """Degrees come from the actor_edges collection built by build_edges.py"""
+    from sampler import degrees_query
+
+    degrees = {
+        entry["_id"]: entry["degree"]
+        for entry in db["actor_edges"].aggregate(degrees_query, allowDiskUse=True)
+    }
+    display_names, actor_degrees = [], []
+    for actor in db["name_basics"].find({}, {"primaryName": 1}):
+        display_names.append(actor["primaryName"])
+        actor_degrees.append(degrees.get(actor["_id"], 0))
+    return TypeaheadIndex.build(display_names, actor_degrees)
+
+
+def typeahead_from_local_graph(graph):
+    return TypeaheadIndex.build(graph.actors["primaryName"].tolist(), np.diff(graph.offsets))
+
+
+if __name__ == "__main__":
+    # python typeahead.py [output path], reads from the configured GRAPH_BACKEND
+    from db import GRAPH_BACKEND, database
+
+    output_path = sys.argv[1] if len(sys.argv) > 1 else TYPEAHEAD_PATH
+    if GRAPH_BACKEND == "local":
+        index = typeahead_from_local_graph(database)
+    else:
+        index = typeahead_from_mongo(database)
+    index.save(output_path)
+    print(f"{len(index.names)} names indexed in {output_path}")
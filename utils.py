@@ -1,6 +1,433 @@
-from dash import html
+import math
+from collections import Counter, defaultdict
 
-from formatting import edge_string, node_string
+from dash import Patch, html
+
+from clustering import get_communities
+from formatting import edge_string, node_string, normalize_name
+
+GRAM_LENGTH = 3
+# share of the query trigrams a name needs for a fuzzy match
+FUZZY_MIN_SIMILARITY = 0.6
+# side of the cells of the position grid, twice the default edge length of layout.py
+GRID_CELL_SIZE = 100.0
+
+
+def ngrams(text, n):
+    return {text[i : i + n] for i in range(len(text) - n + 1)}
+
+
+class TrigramIndex:
+    """Substring and fuzzy search over names through n-gram posting lists,
+    maintained incrementally as names are added and removed.
+    Grams of length 1 to 3 are indexed so that short queries are a single lookup."""
+
+    def __init__(self):
+        # key -> normalized name
+        self.names = {}
+        # gram -> keys of the names containing it
+        self.postings = defaultdict(set)
+
+    @staticmethod
+    def _grams(name):
+        return {
+            name[i : i + n] for n in range(1, GRAM_LENGTH + 1) for i in range(len(name) - n + 1)
+        }
+
+    def add(self, key, name):
+        name = normalize_name(name)
+        self.names[key] = name
+        for gram in self._grams(name):
+            self.postings[gram].add(key)
+
+    def remove(self, key):
+        name = self.names.pop(key, None)
+        if name is None:
+            return
+        for gram in self._grams(name):
+            posting = self.postings[gram]
+            posting.discard(key)
+            if not posting:
+                del self.postings[gram]
+
+    def search(self, query):
+        """Keys of the names containing query"""
+        query = normalize_name(query)
+        if not query:
+            return set()
+        if len(query) <= GRAM_LENGTH:
+            return set(self.postings.get(query, ()))
+        # intersect from the shortest posting list, then check the candidates
+        postings = sorted(
+            (self.postings.get(gram, set()) for gram in ngrams(query, GRAM_LENGTH)), key=len
+        )
+        candidates = set.intersection(*postings)
+        return {key for key in candidates if query in self.names[key]}
+
+    def fuzzy_search(self, query):
+        """Keys of the names sharing most trigrams with query"""
+        query_grams = ngrams(normalize_name(query), GRAM_LENGTH)
+        counts = Counter(key for gram in query_grams for key in self.postings.get(gram, ()))
+        min_count = FUZZY_MIN_SIMILARITY * len(query_grams)
+        return {key for key, count in counts.items() if count >= min_count}
+
+    def matches(self, key, query, fuzzy=False):
+        """Same as key in search(query), or in fuzzy_search(query), for a single key"""
+        query, name = normalize_name(query), self.names[key]
+        if not fuzzy:
+            return bool(query) and query in name
+        query_grams = ngrams(query, GRAM_LENGTH)
+        common_grams = query_grams & ngrams(name, GRAM_LENGTH)
+        return bool(query_grams) and len(common_grams) >= FUZZY_MIN_SIMILARITY * len(query_grams)
+
+
+class PositionGrid:
+    """Positions of the placed nodes bucketed in square cells, so that the nodes around
+    a point are found without scanning the whole graph"""
+
+    def __init__(self, cell_size=GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        # key -> (x, y)
+        self.positions = {}
+        # (cell x, cell y) -> keys of the positions in the cell
+        self.cells = defaultdict(set)
+
+    def _cell(self, x, y):
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def add(self, key, x, y):
+        self.remove(key)
+        self.positions[key] = (x, y)
+        self.cells[self._cell(x, y)].add(key)
+
+    def remove(self, key):
+        position = self.positions.pop(key, None)
+        if position is None:
+            return
+        cell = self._cell(*position)
+        self.cells[cell].discard(key)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def around(self, x, y, radius):
+        """Keys of the positions closer than radius to (x, y)"""
+        low_x, low_y = self._cell(x - radius, y - radius)
+        high_x, high_y = self._cell(x + radius, y + radius)
+        keys = set()
+        for cell_x in range(low_x, high_x + 1):
+            for cell_y in range(low_y, high_y + 1):
+                for key in self.cells.get((cell_x, cell_y), ()):
+                    key_x, key_y = self.positions[key]
+                    if (key_x - x) ** 2 + (key_y - y) ** 2 < radius**2:
+                        keys.add(key)
+        return keys
+
+    def bounds(self):
+        """(low, high) corners of the occupied cells, None if there is no position"""
+        if not self.cells:
+            return None
+        xs, ys = zip(*self.cells)
+        low = (min(xs) * self.cell_size, min(ys) * self.cell_size)
+        high = ((max(xs) + 1) * self.cell_size, (max(ys) + 1) * self.cell_size)
+        return low, high
+
+
+class GraphState:
+    """Cytoscape elements with hashed indexes, converted from and to the element list
+    at the boundary.
+
+    elements is a list of slots mirroring the client elements: removing an element moves
+    the last one into its slot, so that adds, removes and lookups are O(1) and each change
+    is replayed on the client by a couple of Patch operations."""
+
+    def __init__(self, filter_input=None, layout_options=None):
+        self.elements = []
+        # element id -> slot in elements
+        self.slots = {}
+        # node id -> {neighbor id: edge id}
+        self.adjacency = {}
+        # nodes of degree 0
+        self.lonely = set()
+        # on-graph filter and the nodes it matches, flagged with data(filtered)
+        self.filter_input = filter_input
+        self.filter_fuzzy = False
+        self.filtered = set()
+        # built from the node ids when needed, see name_index
+        self._name_index = TrigramIndex()
+        # movie id -> title_basics document, shared by the edges listing it in data(movie_ids),
+        # only filled for the edges that were selected
+        self.movies = {}
+        # movie id -> number of edges listing it
+        self.movie_refs = Counter()
+        # options of the server-side layout, None when the client lays out, see layout.py
+        self.layout_options = layout_options
+        # nodes waiting for a position from the server-side layout
+        self.unplaced = set()
+        # positions of the placed nodes, built from the elements when needed, see position_grid
+        self._position_grid = PositionGrid()
+        # level of detail, see clustering.py: communities (None until detected again),
+        # communities shown actor by actor, whether the client holds the reduced view
+        # and what it was last sent of it, see level_of_detail_patch
+        self.communities = None
+        self.expanded_communities = []
+        self.lod_active = False
+        self.lod_view = None
+        # pending changes to send to the client, see flush_patch
+        self.operations = []
+        # element id -> data keys changed since the last flush
+        self.dirty_data = {}
+        # placed nodes whose position changed since the last flush
+        self.moved = set()
+        # updates sent to the client so far, see update_session_graph in app.py
+        self.version = 0
+
+    def __getstate__(self):
+        """Derived indexes are left out of pickles, they are built again when needed"""
+        state = dict(self.__dict__)
+        state["_name_index"] = None
+        state["_position_grid"] = None
+        state["communities"] = None
+        return state
+
+    def __setstate__(self, state):
+        # graphs pickled before an attribute was added get its initial value
+        self.__dict__.update(GraphState().__dict__)
+        self.__dict__.update(state)
+
+    @property
+    def name_index(self):
+        """Only built once a filter needs it, adds and removes then keep it up to date"""
+        if self._name_index is None:
+            self._name_index = TrigramIndex()
+            for node_id in self.adjacency:
+                self._name_index.add(node_id, node_id)
+        return self._name_index
+
+    @property
+    def position_grid(self):
+        """Only built once a layout needs it, positions then keep it up to date"""
+        if self._position_grid is None:
+            self._position_grid = PositionGrid()
+            for node_id in self.adjacency:
+                position = self.get(node_id).get("position")
+                if position is not None:
+                    self._position_grid.add(node_id, position["x"], position["y"])
+        return self._position_grid
+
+    def clear(self):
+        """Removes everything but the filter and layout options,
+        the client is expected to receive []"""
+        version = self.version
+        self.__init__(self.filter_input, self.layout_options)
+        self.version = version
+
+    def to_elements(self):
+        return list(self.elements)
+
+    def __contains__(self, element_id):
+        return element_id in self.slots
+
+    def __len__(self):
+        return len(self.elements)
+
+    def get(self, element_id):
+        slot = self.slots.get(element_id)
+        return None if slot is None else self.elements[slot]
+
+    def is_node(self, element_id):
+        return element_id in self.adjacency
+
+    def degree(self, node_id):
+        return self.get(node_id)["data"]["degree"]
+
+    def _set_data(self, element_id, key, value):
+        data = self.get(element_id)["data"]
+        if data.get(key) != value:
+            data[key] = value
+            self.dirty_data.setdefault(element_id, set()).add(key)
+
+    def _update_degree(self, node_id):
+        degree = len(self.adjacency[node_id])
+        self._set_data(node_id, "degree", degree)
+        if degree == 0:
+            self.lonely.add(node_id)
+        else:
+            self.lonely.discard(node_id)
+
+    def matches_filter(self, node_id):
+        if not self.filter_input:
+            return False
+        return self.name_index.matches(node_id, self.filter_input, self.filter_fuzzy)
+
+    def set_filter(self, filter_input):
+        """Flags the nodes matching filter_input and their edges,
+        only the elements whose flag changes are sent to the client.
+        Falls back on fuzzy matching when no name contains filter_input."""
+        self.filter_input = filter_input
+        filtered = self.name_index.search(filter_input) if filter_input else set()
+        # a name containing filter_input also shares all its trigrams
+        self.filter_fuzzy = not filtered and len(normalize_name(filter_input or "")) >= GRAM_LENGTH
+        if self.filter_fuzzy:
+            filtered = self.name_index.fuzzy_search(filter_input)
+        for node_id in filtered ^ self.filtered:
+            is_filtered = node_id in filtered
+            self._set_data(node_id, "filtered", is_filtered)
+            for neighbor_id, edge_id in self.adjacency[node_id].items():
+                edge_filtered = is_filtered or neighbor_id in filtered
+                self._set_data(edge_id, "filtered", edge_filtered)
+        self.filtered = filtered
+
+    def set_position(self, node_id, x, y):
+        self.get(node_id)["position"] = {"x": float(x), "y": float(y)}
+        if self._position_grid is not None:
+            self._position_grid.add(node_id, float(x), float(y))
+        self.unplaced.discard(node_id)
+        self.moved.add(node_id)
+
+    def reset_positions(self):
+        """Marks every node as waiting for the server-side layout"""
+        for node_id in self.adjacency:
+            self.get(node_id).pop("position", None)
+        self.unplaced = set(self.adjacency)
+        self.moved = set()
+        self._position_grid = PositionGrid()
+
+    def edge_id(self, source, target):
+        return self.adjacency.get(source, {}).get(target)
+
+    def get_edge(self, source, target):
+        edge_id = self.edge_id(source, target)
+        return None if edge_id is None else self.get(edge_id)
+
+    def _append(self, element):
+        self.slots[element["data"]["id"]] = len(self.elements)
+        self.elements.append(element)
+        self.operations.append(("append", element))
+        self.communities = None
+
+    def _remove(self, element_id):
+        self.dirty_data.pop(element_id, None)
+        self.moved.discard(element_id)
+        slot = self.slots.pop(element_id)
+        last_element = self.elements.pop()
+        if slot < len(self.elements):
+            # fill the hole with the last element
+            self.elements[slot] = last_element
+            self.slots[last_element["data"]["id"]] = slot
+            self.operations.append(("set", slot, last_element))
+        self.operations.append(("delete", len(self.elements)))
+        self.communities = None
+
+    def add_node(self, data):
+        """Returns False if the node is already there"""
+        if data["id"] in self.slots:
+            return False
+        self.adjacency[data["id"]] = {}
+        if self._name_index is not None:
+            self._name_index.add(data["id"], data["id"])
+        data["degree"] = 0
+        self.lonely.add(data["id"])
+        self.unplaced.add(data["id"])
+        data["filtered"] = self.matches_filter(data["id"])
+        if data["filtered"]:
+            self.filtered.add(data["id"])
+        self._append({"data": data})
+        return True
+
+    def add_edge(self, data):
+        """Returns False if the edge or an edge between the same nodes is already there"""
+        source, target = data["source"], data["target"]
+        if data["id"] in self.slots or self.edge_id(source, target) is not None:
+            return False
+        self.movie_refs.update(data.get("movie_ids", []))
+        self.adjacency[source][target] = data["id"]
+        self.adjacency[target][source] = data["id"]
+        data["filtered"] = source in self.filtered or target in self.filtered
+        self._append({"data": data})
+        self._update_degree(source)
+        self._update_degree(target)
+        return True
+
+    def add_movies(self, movies):
+        """Interns movie documents in the movie table, if an edge lists them"""
+        for movie in movies:
+            if movie is not None and movie["_id"] in self.movie_refs:
+                self.movies[movie["_id"]] = movie
+
+    def missing_movies(self, edge_ids):
+        """Ids of the movies of these edges that are not in the movie table yet"""
+        movie_ids = set()
+        for edge_id in edge_ids:
+            edge = self.get(edge_id)
+            if edge is not None:
+                movie_ids.update(edge["data"].get("movie_ids", []))
+        return sorted(movie_ids - self.movies.keys())
+
+    def _release_movies(self, movie_ids):
+        """Drops the movies no edge lists anymore from the movie table"""
+        self.movie_refs.subtract(movie_ids)
+        for movie_id in movie_ids:
+            if self.movie_refs[movie_id] <= 0:
+                del self.movie_refs[movie_id]
+                self.movies.pop(movie_id, None)
+
+    def remove_node(self, node_id):
+        """Also removes the edges of the node, returns False if the node is not there"""
+        if not self.is_node(node_id):
+            return False
+        for neighbor_id, edge_id in self.adjacency.pop(node_id).items():
+            del self.adjacency[neighbor_id][node_id]
+            self._release_movies(self.get(edge_id)["data"].get("movie_ids", []))
+            self._remove(edge_id)
+            self._update_degree(neighbor_id)
+        self._remove(node_id)
+        self.lonely.discard(node_id)
+        self.unplaced.discard(node_id)
+        self.filtered.discard(node_id)
+        if self._name_index is not None:
+            self._name_index.remove(node_id)
+        if self._position_grid is not None:
+            self._position_grid.remove(node_id)
+        return True
+
+    def has_changes(self):
+        """Whether elements changed since the last flush"""
+        return bool(self.operations or self.dirty_data or self.moved)
+
+    def flush_patch(self):
+        """Patch replaying the changes made since the last flush on the client elements"""
+        patch = Patch()
+        appended = []
+        appended_ids = set()
+        for operation in self.operations:
+            if operation[0] == "append":
+                appended.append(operation[1])
+                appended_ids.add(operation[1]["data"]["id"])
+                continue
+            if appended:
+                patch.extend(appended)
+                appended = []
+            if operation[0] == "set":
+                patch[operation[1]] = operation[2]
+            else:
+                del patch[operation[1]]
+        if appended:
+            patch.extend(appended)
+        # one update per changed data key, at the final slot of the element,
+        # appended elements are sent with their final data already
+        for element_id, keys in self.dirty_data.items():
+            if element_id in appended_ids:
+                continue
+            slot = self.slots[element_id]
+            for key in keys:
+                patch[slot]["data"][key] = self.elements[slot]["data"][key]
+        for node_id in self.moved - appended_ids:
+            slot = self.slots[node_id]
+            patch[slot]["position"] = self.elements[slot]["position"]
+        self.operations = []
+        self.dirty_data = {}
+        self.moved = set()
+        return patch
 
 
 def get_nodes(elements):
@@ -31,9 +458,8 @@ def get_degrees(elements):
     return degrees
 
 
-def get_single_node_info(data_node, elements):
-    degrees = get_degrees(elements)
-    nb_connections = degrees[data_node["id"]]
+def get_single_node_info(data_node, graph):
+    nb_connections = graph.degree(data_node["id"])
     # add s at the end of the word if required
     s = "s" if nb_connections > 1 else ""
     return html.P(
@@ -45,11 +471,29 @@ def get_single_node_info(data_node, elements):
     )
 
 
-def get_single_edge_info(data_edge, elements):
-    edges = get_edges(elements)
-    correct_edge = next(filter(lambda x: x["data"]["id"] == data_edge["id"], edges))
-    common_movies = correct_edge["data"]["common_movies"]
-    basic_str = edge_string(common_movies.values())
+def get_community_info(data_node, graph):
+    members = get_communities(graph).get(data_node["community"], [])
+    best_connected = sorted(members, key=lambda node_id: -graph.degree(node_id))[:5]
+    return html.P(
+        [
+            f"{len(members)} actors, including {', '.join(best_connected)}",
+            html.Br(),
+            "Click to show them all",
+        ]
+    )
+
+
+def get_aggregate_edge_info(data_edge):
+    s = "s" if data_edge["weight"] > 1 else ""
+    return html.P(f"{data_edge['weight']} co-star relation{s} between these groups")
+
+
+def get_single_edge_info(data_edge, graph):
+    # O(1) lookup, by id or by the sorted (source, target) pair
+    correct_edge = graph.get(data_edge["id"]) or graph.get_edge(
+        data_edge["source"], data_edge["target"]
+    )
+    basic_str = edge_string(correct_edge["data"]["movie_ids"], graph.movies)
     lines = basic_str.split("\n")
     html_lines = html.Ul([html.Li(line) for line in lines[1:]])
     return html.P(